@@ -10,7 +10,8 @@ import streamlit as st
 
 from personal_finance.figures.monthly_bars import prepare_monthly_diff
 
-from personal_finance.data import create_accounts, create_holdings
+from personal_finance.data import WorkbookSource, create_accounts, create_holdings, reload_accounts
+from personal_finance.snapshot import SnapshotStore
 
 from dashboard.fragments import (
     show_monthly_diff,
@@ -46,14 +47,18 @@ if "year_data" not in st.session_state:
     st.session_state.year_data = None
 
 if uploaded_file:
-    accounts = create_accounts(uploaded_file)
-    holdings = create_holdings(uploaded_file)
+    source = WorkbookSource(uploaded_file, snapshots=SnapshotStore())
+    if st.session_state.accounts is not None:
+        accounts, _ = reload_accounts(source, st.session_state.accounts)
+    else:
+        accounts = create_accounts(source)
+    holdings = create_holdings(source)
     st.session_state.accounts = accounts
 
 if st.session_state.accounts:
     accounts = st.session_state.accounts
     accounts.calculate_balances()
-    st.session_state.year_data = prepare_monthly_diff(accounts.merged_balances)
+    st.session_state.year_data = prepare_monthly_diff(accounts.rollup("ME"))
 
     show_summary(accounts)
 
@@ -22,10 +22,7 @@ def show_summary(accounts):
     negative_accounts = (latest < 0).sum()
 
     one_year_ago_date = accounts.merged_balances.index[-1] - pd.DateOffset(years=1)
-    past_idx = accounts.merged_balances.index.get_indexer(
-        [one_year_ago_date], method="nearest"
-    )[0]
-    balance_1yr_ago = accounts.merged_balances.iloc[past_idx].sum()
+    balance_1yr_ago = accounts.balance_as_of(one_year_ago_date)["total"]
     delta_balance = total_balance - balance_1yr_ago
 
     number_transactions = sum(len(acc.transactions) for acc in accounts.values())
@@ -75,7 +72,7 @@ def show_account_line(accounts):
 
 @st.fragment
 def show_balance_pie(accounts):
-    monthly_dates = sorted(accounts.merged_balances.resample("ME").last().index.date,
+    monthly_dates = sorted(accounts.rollup("ME").index.date,
                            reverse=True)
     selected_date = st.selectbox("Select a month", monthly_dates)
 
@@ -94,6 +91,8 @@ def show_stacked_barchart(accounts, min_date, max_date, default_start, default_e
     )
     fig = plot_stacked_ts_balance_by_bank(accounts, start_date, end_date)
     st.plotly_chart(fig, width='stretch')
+    with st.expander("Window statistics"):
+        st.dataframe(accounts.balance_index().summary(start_date, end_date))
 
 
 
@@ -127,6 +126,8 @@ def show_holdings_stacked(accounts, min_date, max_date, default_start, default_e
     fig = plot_holdings_stacked(accounts, start_date, end_date)
     if fig:
         st.plotly_chart(fig, width='stretch')
+    with st.expander("Holdings window statistics"):
+        st.dataframe(accounts.holdings_index().summary(start_date, end_date))
 
 
 @st.fragment
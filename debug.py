@@ -1,13 +1,31 @@
 import argparse
+import os
 from pathlib import Path
 
-from personal_finance.data import create_accounts, create_holdings
+from personal_finance.data import WorkbookSource, create_accounts, create_holdings
+from personal_finance.holdings import PRICE_DEADLINE_ENV
+from personal_finance.output import HOLDINGS_OUTPUT_ENV
+from personal_finance.providers import PRICE_PROVIDERS_ENV
+from personal_finance.snapshot import DEFAULT_SNAPSHOT_DIR, SnapshotStore
 
 def main():
     parser = argparse.ArgumentParser(description="Debug personal finance data extraction.")
     parser.add_argument("--workbook", type=str, default="data/demo_data.xlsx", help="Path to the excel workbook")
+    parser.add_argument("--snapshots", type=str, default=str(DEFAULT_SNAPSHOT_DIR), help="Directory for parsed sheet snapshots")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used to load account sheets")
+    parser.add_argument("--validation", choices=["full", "sample", "trusted"], default="full", help="Validation mode for account sheets")
+    parser.add_argument("--no-snapshots", action="store_true", help="Always parse the workbook, ignoring snapshots")
+    parser.add_argument("--price-providers", type=str, default=None, help="Comma-separated price providers in priority order, e.g. 'offline'")
+    parser.add_argument("--holdings-output", choices=["none", "csv", "parquet"], default=None, help="Where computed holdings are written")
+    parser.add_argument("--price-deadline", type=str, default=None, help="Seconds to wait for fresh prices before using cached ones ('inf' to always wait)")
     
     args = parser.parse_args()
+    if args.price_providers:
+        os.environ[PRICE_PROVIDERS_ENV] = args.price_providers
+    if args.holdings_output:
+        os.environ[HOLDINGS_OUTPUT_ENV] = args.holdings_output
+    if args.price_deadline:
+        os.environ[PRICE_DEADLINE_ENV] = args.price_deadline
     workbook_path = Path(args.workbook)
     
     if not workbook_path.exists():
@@ -15,10 +33,12 @@ def main():
         return
         
     print(f"Loading data from: {workbook_path}")
+    snapshots = None if args.no_snapshots else SnapshotStore(Path(args.snapshots))
+    source = WorkbookSource(workbook_path, snapshots=snapshots)
     
     # Debug Holdings data creation
     print("\n--- Testing create_holdings ---")
-    holdings_df = create_holdings(workbook_path)
+    holdings_df = create_holdings(source)
     if holdings_df is not None:
         print(f"Holdings read successfully: {len(holdings_df)} rows")
         print("First few rows:")
@@ -28,8 +48,12 @@ def main():
         
     # Debug Accounts creation (this will calculate historical holdings)
     print("\n--- Testing create_accounts ---")
-    accounts = create_accounts(workbook_path)
+    accounts = create_accounts(source, workers=args.workers, validation=args.validation)
     print(f"Loaded {len(accounts)} accounts: {accounts.get_ids()}")
+    print(f"Sheet parses: {source.parse_count} of {len(source.sheet_names)} sheets "
+          f"({source.snapshot_hits} read from snapshots)")
+    print("Validation time per account (ms):")
+    print((accounts.validation_timings() * 1000).round(2).to_string())
     
     if "Holdings" in accounts:
         print("\n--- Holdings Account Debug ---")
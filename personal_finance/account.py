@@ -1,3 +1,7 @@
+import logging
+import time
+
+import numpy as np
 import pandera.pandas as pa
 from collections import UserDict
 from dataclasses import dataclass, field
@@ -5,6 +9,46 @@ from typing import Optional, Literal
 
 import pandas as pd
 
+from personal_finance.balance_matrix import BalanceMatrix, balances_as_of
+from personal_finance.holdings_cube import HoldingsCube
+from personal_finance.range_index import RangeQueryIndex
+
+logger = logging.getLogger(__name__)
+
+TRANSACTIONS_SCHEMA = pa.DataFrameSchema(
+    {
+        "date": pa.Column(pa.DateTime),
+        "balance": pa.Column(float, coerce=True, nullable=True),
+        "transaction_number": pa.Column(float, coerce=True, nullable=True),
+    },
+    strict=False,
+)
+
+# "full" validates every row, "sample" coerces the frame but only checks a
+# random sample of rows, and "trusted" skips validation for frames we
+# generate ourselves (e.g. the Holdings account).
+ValidationMode = Literal["full", "sample", "trusted"]
+VALIDATION_SAMPLE_SIZE = 100
+
+# Weekly, month-end and year-end rollups kept alongside merged_balances
+ROLLUP_FREQUENCIES = ("W", "ME", "YE")
+
+
+def _closing_balances(transactions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Last balance of each transaction day (highest transaction_number wins),
+    carrying the previous day's balance over days whose last row is blank.
+    """
+    closing = (
+        transactions[['date', 'balance', 'transaction_number']]
+        .assign(date=lambda x: pd.to_datetime(x.date, dayfirst=False).dt.normalize())
+        .sort_values(['date', 'transaction_number'], ascending=[True, False], kind='stable')
+        .drop_duplicates(subset='date', keep='first')
+        .set_index('date')
+    )
+    closing['balance'] = closing['balance'].ffill()
+    return closing
+
 
 @dataclass
 class Account:
@@ -16,38 +60,116 @@ class Account:
     status: Literal["Active", "Closed"]
     transactions: pd.DataFrame
     balance: Optional[pd.DataFrame] = None
+    fingerprint: Optional[str] = None
+    validation: ValidationMode = "full"
+    validation_seconds: Optional[float] = field(default=None, repr=False)
+    # Per-ISIN metrics behind the transactions of the generated Holdings account
+    holdings: Optional[HoldingsCube] = field(default=None, repr=False)
+    # Closing balance per transaction day and the daily balance computed so
+    # far, so that calculate_balance only touches new days and transactions.
+    _closing: Optional[pd.DataFrame] = field(default=None, init=False, repr=False)
+    _closing_rows: int = field(default=0, init=False, repr=False)
+    _daily: Optional[pd.Series] = field(default=None, init=False, repr=False)
 
     def __post_init__(self):
-        schema = pa.DataFrameSchema(
-            {
-                "date": pa.Column(pa.DateTime),
-                "balance": pa.Column(float, coerce=True, nullable=True),
-                "transaction_number": pa.Column(float, coerce=True, nullable=True),
-            },
-            strict=False,
-        )
-        self.transactions = schema.validate(self.transactions)
+        start = time.perf_counter()
+        if self.validation == "sample" and len(self.transactions) > VALIDATION_SAMPLE_SIZE:
+            self.transactions = TRANSACTIONS_SCHEMA.validate(
+                self.transactions, sample=VALIDATION_SAMPLE_SIZE, random_state=0
+            )
+        elif self.validation in ("full", "sample"):
+            self.transactions = TRANSACTIONS_SCHEMA.validate(self.transactions)
+        elif self.validation != "trusted":
+            raise ValueError(f"Unknown validation mode '{self.validation}'")
+        self.validation_seconds = time.perf_counter() - start
+        logger.debug(f"Validated '{self.account_id}' ({self.validation}) in {self.validation_seconds * 1000:.1f} ms")
+
+    def append_transactions(self, transactions: pd.DataFrame):
+        if self.validation != "trusted":
+            transactions = TRANSACTIONS_SCHEMA.validate(transactions)
+        self.transactions = pd.concat([self.transactions, transactions], ignore_index=True)
+
+    def closing_balances(self) -> pd.DataFrame:
+        n_rows = len(self.transactions)
+        if self._closing is None or n_rows < self._closing_rows:
+            self._closing = _closing_balances(self.transactions)
+            self._daily = None
+        elif n_rows > self._closing_rows:
+            # Only the appended rows are processed; days they touch are re-resolved
+            new = _closing_balances(self.transactions.iloc[self._closing_rows:])
+            first_new = new.index.min()
+            if first_new > self._closing.index.max():
+                self._closing = pd.concat([self._closing, new])
+                # Blank balances at the start of the new days carry the last known one
+                self._closing['balance'] = self._closing['balance'].ffill()
+            else:
+                self._closing = (
+                    pd.concat([self._closing, new])
+                    .reset_index()
+                    .pipe(_closing_balances)
+                )
+            if self._daily is not None:
+                self._daily = self._daily.loc[:first_new - pd.Timedelta(days=1)]
+        self._closing_rows = n_rows
+        return self._closing
+
+    def _daily_balance(self, start_date: pd.Timestamp, end_date: pd.Timestamp) -> pd.Series:
+        closing = self.closing_balances()
+        daily = self._daily
+        one_day = pd.Timedelta(days=1)
+
+        def as_of(start, end):
+            dates = pd.date_range(start, end)
+            return pd.Series(balances_as_of(closing, dates), index=dates)
+
+        if (daily is None or daily.empty
+                or start_date > daily.index[-1] + one_day or end_date < daily.index[0] - one_day):
+            daily = as_of(start_date, end_date)
+        else:
+            parts = [daily]
+            if start_date < daily.index[0]:
+                parts.insert(0, as_of(start_date, daily.index[0] - one_day))
+            if end_date > daily.index[-1]:
+                parts.append(as_of(daily.index[-1] + one_day, end_date))
+            if len(parts) > 1:
+                daily = pd.concat(parts)
+
+        self._daily = daily
+        return daily.loc[start_date:end_date]
 
     def calculate_balance(self, start_date: str, end_date: str):
-        self.transactions['date'] = pd.to_datetime(self.transactions.date, dayfirst=False).dt.date
-        df_sorted = self.transactions.sort_values(['date', 'transaction_number'], ascending=[True, False])
-        balance = df_sorted.drop_duplicates(subset='date', keep='first')
-        balance = balance.sort_values('date')[['date', 'balance']].reset_index(drop=True)
-        full_dates = pd.date_range(start=start_date, end=end_date)
-        balance = balance.set_index('date').reindex(full_dates)
-        balance.index.name = 'date'
+        start_date = pd.Timestamp(start_date).normalize()
+        end_date = pd.Timestamp(end_date).normalize()
         self.balance = (
-            balance
-            .ffill()
+            self._daily_balance(start_date, end_date)
+            .rename(self.account_id)
+            .rename_axis('date')
             .reset_index()
-            .rename(columns={'balance': self.account_id}, inplace=False)
+        )
+
+    def balance_as_of(self, date) -> float:
+        """Balance at the end of ``date``, looked up from the change points in O(log n)."""
+        closing = self.closing_balances()
+        position = closing.index.searchsorted(pd.Timestamp(date).normalize(), side='right') - 1
+        return float(closing['balance'].iat[position]) if position >= 0 else np.nan
+
+    def balances_as_of(self, dates) -> pd.Series:
+        dates = pd.DatetimeIndex(dates).normalize()
+        return pd.Series(
+            balances_as_of(self.closing_balances(), dates),
+            index=dates.rename('date'),
+            name=self.account_id,
         )
 
 
 class AccountList(UserDict):
-    def __init__(self, accounts: dict[str, Account] = None):
+    def __init__(self, accounts: dict[str, Account] = None, balance_dtype=np.float64):
         super().__init__(accounts or {})
         self.merged_balances: Optional[pd.DataFrame] = None
+        self.balance_matrix: Optional[BalanceMatrix] = None
+        self.balance_dtype = balance_dtype
+        self.rollups: dict[str, pd.DataFrame] = {}
+        self._range_indexes: dict[str, RangeQueryIndex] = {}
 
     def get_ids(self) -> list[str]:
         return list(self.data.keys())
@@ -55,49 +177,126 @@ class AccountList(UserDict):
     def get_account(self, account_id: str) -> Account:
         return self.data[account_id]
 
+    def validation_timings(self) -> pd.Series:
+        return pd.Series(
+            {account_id: account.validation_seconds for account_id, account in self.data.items()},
+            name="validation_seconds",
+            dtype=float,
+        )
+
     def calculate_balances(self, start_date: Optional[str] = None, end_date: Optional[str] = None):
         if not self.data:
             self.merged_balances = pd.DataFrame()
             return
             
         if start_date is None:
-            start_date = min([min(acc.transactions.date.to_list()) for acc in self.data.values()])
+            start_date = min([pd.to_datetime(acc.transactions.date).min() for acc in self.data.values()])
         if end_date is None:
-            end_date = max([max(acc.transactions.date.to_list()) for acc in self.data.values()])
-            
-        for account in self.data.values():
-            account.calculate_balance(start_date, end_date)
+            end_date = max([pd.to_datetime(acc.transactions.date).max() for acc in self.data.values()])
 
-        self.merge_balances()
+        self.merge_balances(pd.date_range(pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize()))
 
-    def merge_balances(self):
-        frames = []
-        for account in self.data.values():
-            if account.balance is not None:
-                balance = account.balance[['date', account.account_id]]
-                frames.append(balance.set_index('date'))
+        # Each account's balance as calculate_balance gives it, sliced from the matrix
+        for account_id, account in self.data.items():
+            column = self.merged_balances[account_id]
+            first_day = account.closing_balances().index.min()
+            account.balance = (
+                column.where(column.index >= first_day)
+                .rename_axis('date')
+                .reset_index()
+            )
 
-        if not frames:
-            return
-            
-        merged_balances = pd.concat(frames, axis=1, join='outer')
-        merged_balances.index = pd.to_datetime(merged_balances.index)
-        full_dates = pd.date_range(merged_balances.index.min(), merged_balances.index.max())
-        merged_balances = (
-            merged_balances.reindex(full_dates)
-            .rename_axis('date')
-            .fillna(0)
-            .ffill()
+    def balance_as_of(self, date) -> pd.Series:
+        """Balance of every account plus ``total`` at the end of ``date``."""
+        return self.balances_as_of([date]).iloc[0]
+
+    def balances_as_of(self, dates) -> pd.DataFrame:
+        """
+        Balances of every account plus ``total`` on the given dates, computed
+        from change points without building the daily grid. Accounts with no
+        history yet count as 0, as in ``merged_balances``.
+        """
+        dates = pd.DatetimeIndex(dates).normalize()
+        balances = pd.DataFrame(
+            {account_id: account.balances_as_of(dates) for account_id, account in self.data.items()},
+            index=dates.rename('date'),
+        ).fillna(0)
+        balances['total'] = balances.sum(axis=1)
+        return balances
+
+    def carry_over_balances(self, previous: "AccountList"):
+        """
+        Reuse the balance matrix of a previous load of the same workbook, so
+        that the next ``calculate_balances`` only recomputes the columns of
+        accounts that were rebuilt.
+        """
+        self.balance_matrix = previous.balance_matrix
+        self.merged_balances = previous.merged_balances
+        self.balance_dtype = previous.balance_dtype
+        self.rollups = previous.rollups
+
+    def merge_balances(self, dates: Optional[pd.DatetimeIndex] = None):
+        if dates is None:
+            if self.balance_matrix is None:
+                return
+            dates = self.balance_matrix.dates
+
+        change_points = {account_id: account.closing_balances() for account_id, account in self.data.items()}
+        self.balance_matrix = BalanceMatrix.from_change_points(
+            change_points, dates, dtype=self.balance_dtype, reuse=self.balance_matrix
         )
-        merged_balances['total'] = merged_balances.sum(axis=1)
+        self.merged_balances = self.balance_matrix.to_frame()
+        self.rollups = {
+            freq: self.merged_balances.resample(freq).last()
+            for freq in ROLLUP_FREQUENCIES
+        }
+        self._range_indexes.pop("balances", None)
 
-        self.merged_balances = merged_balances
+    def balance_index(self) -> RangeQueryIndex:
+        """Window statistics over ``merged_balances``, built once per merge."""
+        if "balances" not in self._range_indexes:
+            self._range_indexes["balances"] = RangeQueryIndex(self.merged_balances)
+        return self._range_indexes["balances"]
 
-    def __getitem__(self, key):
-        if isinstance(key, int):
-            return list(self.data.values())[key]
-        return super().__getitem__(key)
+    def holdings_index(self) -> Optional[RangeQueryIndex]:
+        """Window statistics over the numeric columns of the Holdings account."""
+        if "Holdings" not in self.data:
+            return None
+        if "holdings" not in self._range_indexes:
+            transactions = self.data["Holdings"].transactions
+            frame = (
+                transactions
+                .set_index(pd.to_datetime(transactions['date']))
+                .drop(columns=['date', 'transaction_number'])
+                .select_dtypes('number')
+            )
+            self._range_indexes["holdings"] = RangeQueryIndex(frame)
+        return self._range_indexes["holdings"]
 
+    def rollup(self, freq: str = "ME", start_date=None, end_date=None) -> pd.DataFrame:
+        """
+        Period-end balances (``freq`` is one of ``ROLLUP_FREQUENCIES``),
+        equivalent to ``merged_balances.loc[start_date:end_date].resample(freq).last()``
+        but read from the rollups computed once in ``merge_balances``.
+        """
+        rollup = self.rollups[freq]
+        if start_date is None and end_date is None:
+            return rollup
 
+        offset = pd.tseries.frequencies.to_offset(freq)
+        merged = self.merged_balances
+        start = max(pd.Timestamp(start_date), merged.index[0]) if start_date is not None else merged.index[0]
+        end = min(pd.Timestamp(end_date), merged.index[-1]) if end_date is not None else merged.index[-1]
+        if start > end:
+            return rollup.iloc[0:0]
 
+        window = rollup.loc[offset.rollforward(start):offset.rollforward(end)].copy()
+        # A window ending mid-period closes that period on its last day
+        if end < window.index[-1]:
+            window.iloc[-1] = merged.loc[end]
+        return window
 
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.data.values())[key]
+        return super().__getitem__(key)
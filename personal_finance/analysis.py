@@ -2,9 +2,10 @@ import tomllib
 from datetime import datetime
 from pathlib import Path
 
-from personal_finance.data import create_accounts
+from personal_finance.data import WorkbookSource, create_accounts
 from personal_finance.figures import plot_line_chart_account, plot_line_chart_all, plot_monthly_balance_bars, \
     plot_monthly_stacked_balance_by_bank, plot_monthly_diff
+from personal_finance.snapshot import SnapshotStore
 
 
 def main():
@@ -14,7 +15,8 @@ def main():
     start_date = datetime(2020, 11, 1)
     end_date = datetime(2025, 10, 31)
 
-    accounts = create_accounts(config["balance_table"])
+    snapshots = SnapshotStore(Path(config['outputs']) / "snapshots")
+    accounts = create_accounts(WorkbookSource(config["balance_table"], snapshots=snapshots))
     accounts.calculate_balances(start_date, end_date)
     plot_monthly_diff(accounts, Path(config['outputs']) / "figures")
     # plot_line_chart_account(accounts, Path(config['outputs']) / "figures")
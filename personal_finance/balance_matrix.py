@@ -0,0 +1,101 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+def balances_as_of(closing: pd.DataFrame, dates: pd.DatetimeIndex) -> np.ndarray:
+    """Balance carried forward from the last transaction day on or before each date."""
+    values = closing['balance'].to_numpy(dtype=float)
+    if len(values) == 0:
+        return np.full(len(dates), np.nan)
+    positions = closing.index.searchsorted(dates, side='right') - 1
+    return np.where(positions >= 0, values[np.maximum(positions, 0)], np.nan)
+
+
+class BalanceMatrix:
+    """
+    Daily balances of many accounts as one contiguous dates x accounts array.
+
+    The last column holds the total. Each account column is filled straight
+    from the account's change points (its closing balance per transaction
+    day), and ``to_frame`` exposes the array as a DataFrame without copying.
+    """
+
+    def __init__(
+        self,
+        dates: pd.DatetimeIndex,
+        account_ids: list[str],
+        values: np.ndarray,
+        sources: dict[str, pd.DataFrame],
+    ):
+        self.dates = dates
+        self.account_ids = account_ids
+        self.values = values
+        # Change-point frames each column was built from; a column is reused
+        # by the next build only while its account still has the same frame.
+        self.sources = sources
+        self._frame: Optional[pd.DataFrame] = None
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.values.dtype
+
+    @classmethod
+    def from_change_points(
+        cls,
+        change_points: dict[str, pd.DataFrame],
+        dates: pd.DatetimeIndex,
+        dtype=np.float64,
+        reuse: Optional["BalanceMatrix"] = None,
+    ) -> "BalanceMatrix":
+        """
+        Build the matrix for ``dates`` (a daily range).
+
+        Columns of ``reuse`` whose change points are unchanged are copied for
+        the days both matrices share, so only new days and changed accounts
+        are computed.
+        """
+        account_ids = list(change_points)
+        values = np.empty((len(dates), len(account_ids) + 1), dtype=dtype)
+
+        overlap = None
+        if reuse is not None and reuse.dtype == values.dtype and len(dates) and len(reuse.dates):
+            first = max(dates[0], reuse.dates[0])
+            last = min(dates[-1], reuse.dates[-1])
+            if first <= last:
+                n_days = (last - first).days + 1
+                target = (first - dates[0]).days
+                origin = (first - reuse.dates[0]).days
+                overlap = (slice(target, target + n_days), slice(origin, origin + n_days))
+
+        for j, account_id in enumerate(account_ids):
+            closing = change_points[account_id]
+            if overlap is not None and reuse.sources.get(account_id) is closing:
+                target, origin = overlap
+                column = values[:, j]
+                column[target] = reuse.values[origin, reuse.account_ids.index(account_id)]
+                if target.start > 0:
+                    column[:target.start] = balances_as_of(closing, dates[:target.start])
+                if target.stop < len(dates):
+                    column[target.stop:] = balances_as_of(closing, dates[target.stop:])
+            else:
+                values[:, j] = balances_as_of(closing, dates)
+
+        np.nan_to_num(values[:, :-1], copy=False, nan=0.0)
+        values[:, -1] = values[:, :-1].sum(axis=1, dtype=np.float64)
+        return cls(dates, account_ids, values, dict(change_points))
+
+    def column(self, account_id: str) -> np.ndarray:
+        return self.values[:, self.account_ids.index(account_id)]
+
+    def to_frame(self) -> pd.DataFrame:
+        """Zero-copy DataFrame view with one column per account plus ``total``."""
+        if self._frame is None:
+            self._frame = pd.DataFrame(
+                self.values,
+                index=self.dates.rename('date'),
+                columns=self.account_ids + ['total'],
+                copy=False,
+            )
+        return self._frame
@@ -0,0 +1,192 @@
+import logging
+from datetime import date, timedelta
+from functools import cache
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from personal_finance.intervals import Interval
+
+logger = logging.getLogger(__name__)
+
+# Optional extra closures per exchange, one ``date`` column per file
+# (e.g. ``data/calendars/XLON.csv``), added to the built-in holiday rules
+LOCAL_CALENDAR_DIR = Path("data") / "calendars"
+
+# Years the built-in holiday rules are generated for
+HOLIDAY_YEARS = range(1990, 2041)
+
+
+def _easter(year: int) -> date:
+    """Gregorian Easter Sunday (anonymous Gregorian algorithm)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+    """The n-th (1-based, or -1 for last) given weekday of a month."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _next_weekday(day: date, taken: set[date] = frozenset()) -> date:
+    while day.weekday() >= 5 or day in taken:
+        day += timedelta(days=1)
+    return day
+
+
+def _london_holidays(year: int) -> list[date]:
+    """England and Wales bank holidays, when the London Stock Exchange is closed."""
+    easter = _easter(year)
+    holidays = [
+        _next_weekday(date(year, 1, 1)),
+        easter - timedelta(days=2),
+        easter + timedelta(days=1),
+        _nth_weekday(year, 5, 0, -1),
+        _nth_weekday(year, 8, 0, -1),
+    ]
+    christmas = _next_weekday(date(year, 12, 25))
+    holidays += [christmas, _next_weekday(date(year, 12, 26), {christmas})]
+
+    # Early May bank holiday, moved for VE day anniversaries
+    holidays.append({1995: date(1995, 5, 8), 2020: date(2020, 5, 8)}.get(year, _nth_weekday(year, 5, 0, 1)))
+    # Spring bank holiday, moved for jubilees
+    if year in (2002, 2012, 2022):
+        holidays.remove(_nth_weekday(year, 5, 0, -1))
+        holidays += {
+            2002: [date(2002, 6, 3), date(2002, 6, 4)],
+            2012: [date(2012, 6, 4), date(2012, 6, 5)],
+            2022: [date(2022, 6, 2), date(2022, 6, 3)],
+        }[year]
+    holidays += {
+        1999: [date(1999, 12, 31)],
+        2011: [date(2011, 4, 29)],
+        2022: [date(2022, 9, 19)],
+        2023: [date(2023, 5, 8)],
+    }.get(year, [])
+    return holidays
+
+
+def _observed_us(day: date) -> date:
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def _new_york_holidays(year: int) -> list[date]:
+    """New York Stock Exchange full-day closures."""
+    holidays = [
+        _nth_weekday(year, 1, 0, 3),
+        _nth_weekday(year, 2, 0, 3),
+        _easter(year) - timedelta(days=2),
+        _nth_weekday(year, 5, 0, -1),
+        _observed_us(date(year, 7, 4)),
+        _nth_weekday(year, 9, 0, 1),
+        _nth_weekday(year, 11, 3, 4),
+        _observed_us(date(year, 12, 25)),
+    ]
+    # New Year's Day falling on a Saturday is not observed on the Friday before
+    if date(year, 1, 1).weekday() != 5:
+        holidays.append(_observed_us(date(year, 1, 1)))
+    if year >= 2022:
+        holidays.append(_observed_us(date(year, 6, 19)))
+    holidays += {
+        2001: [date(2001, 9, 11), date(2001, 9, 12), date(2001, 9, 13), date(2001, 9, 14)],
+        2004: [date(2004, 6, 11)],
+        2007: [date(2007, 1, 2)],
+        2012: [date(2012, 10, 29), date(2012, 10, 30)],
+        2018: [date(2018, 12, 5)],
+        2025: [date(2025, 1, 9)],
+    }.get(year, [])
+    return holidays
+
+
+HOLIDAY_RULES: dict[str, Callable[[int], list[date]]] = {
+    "XLON": _london_holidays,
+    "XNYS": _new_york_holidays,
+}
+
+# Exchange of a listing from its Yahoo ticker suffix; no suffix means a US listing
+YF_SUFFIX_EXCHANGES = {"L": "XLON", "IL": "XLON", "": "XNYS"}
+
+
+class TradingCalendar:
+    """
+    Trading days of one exchange: weekdays minus its holidays.
+
+    Backed by a numpy business-day calendar, so checking or rolling dates
+    is vectorized.
+    """
+
+    def __init__(self, name: str, holidays: Iterable = ()):
+        self.name = name
+        holidays = np.array(sorted({pd.Timestamp(day).date() for day in holidays}), dtype="datetime64[D]")
+        self._calendar = np.busdaycalendar(weekmask="1111100", holidays=holidays)
+
+    def is_trading_day(self, dates) -> np.ndarray:
+        days = pd.DatetimeIndex(dates).to_numpy().astype("datetime64[D]")
+        return np.is_busday(days, busdaycal=self._calendar)
+
+    def trading_days(self, start_date, end_date) -> pd.DatetimeIndex:
+        days = np.arange(
+            np.datetime64(pd.Timestamp(start_date).date()),
+            np.datetime64(pd.Timestamp(end_date).date()) + 1,
+            dtype="datetime64[D]",
+        )
+        return pd.DatetimeIndex(days[np.is_busday(days, busdaycal=self._calendar)]).as_unit("ns")
+
+    def trim(self, intervals: list[Interval]) -> list[Interval]:
+        """Shrink intervals to their first and last trading days, dropping those without any."""
+        if not intervals:
+            return []
+        starts = np.array([start.date() for start, _ in intervals], dtype="datetime64[D]")
+        ends = np.array([end.date() for _, end in intervals], dtype="datetime64[D]")
+        first = np.busday_offset(starts, 0, roll="forward", busdaycal=self._calendar)
+        last = np.busday_offset(ends, 0, roll="backward", busdaycal=self._calendar)
+        return [
+            (pd.Timestamp(start), pd.Timestamp(end))
+            for start, end in zip(first, last)
+            if start <= end
+        ]
+
+
+@cache
+def trading_calendar(exchange: Optional[str] = None) -> TradingCalendar:
+    """
+    Calendar of an exchange (MIC code), from the built-in holiday rules and
+    ``data/calendars/<exchange>.csv`` if present. Unknown exchanges trade
+    every weekday.
+    """
+    holidays = []
+    rule = HOLIDAY_RULES.get(exchange)
+    if rule is not None:
+        holidays = [day for year in HOLIDAY_YEARS for day in rule(year)]
+    local = LOCAL_CALENDAR_DIR / f"{exchange}.csv"
+    if exchange and local.exists():
+        holidays += pd.read_csv(local, parse_dates=["date"])["date"].tolist()
+        logger.debug(f"Loaded local holidays for {exchange} from {local}")
+    return TradingCalendar(exchange or "weekdays", holidays)
+
+
+def exchange_for(yf_name: Optional[str]) -> Optional[str]:
+    """Best guess of the exchange an asset trades on from its Yahoo ticker."""
+    if not yf_name:
+        return None
+    suffix = yf_name.rsplit(".", 1)[1] if "." in yf_name else ""
+    return YF_SUFFIX_EXCHANGES.get(suffix.upper())
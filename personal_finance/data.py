@@ -1,65 +1,348 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date
 from pathlib import Path
+from typing import Optional, Union
 
 import pandas as pd
 
-from personal_finance.account import Account, AccountList
-from personal_finance.holdings import get_historical_holdings
+from personal_finance.account import Account, AccountList, ValidationMode
+from personal_finance.holdings import export_holdings, holdings_cube
+from personal_finance.snapshot import SnapshotStore, workbook_bytes, workbook_hash
 
+logger = logging.getLogger(__name__)
 
-def create_holdings(table_path: Path):
-    data = pd.read_excel(table_path, sheet_name=None, engine='calamine')
-    if "Holdings" in data:
-        holdings = data["Holdings"].pipe(normalize_column_names)
-        return holdings
+
+class WorkbookSource:
+    """
+    Lazily parsed view of an Excel workbook.
+
+    The workbook is opened once and each sheet is parsed (and its column
+    names normalized and dates parsed) at most once, no matter how many
+    loaders ask for it. ``parse_count`` records how many sheet parses were
+    actually done.
+
+    When a ``SnapshotStore`` is given, sheets of a workbook whose content
+    hash has been seen before are read from their columnar snapshot and the
+    Excel file is not opened at all.
+    """
+
+    def __init__(self, table_path, snapshots: Optional[SnapshotStore] = None):
+        self.table_path = table_path
+        self.snapshots = snapshots
+        self.parse_count = 0
+        self.snapshot_hits = 0
+        self._excel: pd.ExcelFile | None = None
+        self._sheets: dict[str, pd.DataFrame] = {}
+        self._sheet_names: Optional[list[str]] = None
+        self._digest: Optional[str] = None
+        self._fingerprints: dict[str, str] = {}
+
+    def _workbook(self) -> pd.ExcelFile:
+        if self._excel is None:
+            self._excel = pd.ExcelFile(self.table_path, engine='calamine')
+        return self._excel
+
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            self._digest = workbook_hash(self.table_path)
+        return self._digest
+
+    @property
+    def sheet_names(self) -> list[str]:
+        if self._sheet_names is None:
+            if self.snapshots is not None:
+                self._sheet_names = self.snapshots.sheet_names(self.digest)
+            if self._sheet_names is None:
+                self._sheet_names = self._workbook().sheet_names
+                if self.snapshots is not None:
+                    self.snapshots.save_sheet_names(self.digest, self._sheet_names)
+        return self._sheet_names
+
+    def __contains__(self, sheet_name: str) -> bool:
+        return sheet_name in self.sheet_names
+
+    def sheet(self, sheet_name: str) -> pd.DataFrame:
+        if sheet_name not in self._sheets:
+            if sheet_name not in self:
+                raise KeyError(sheet_name)
+            self._sheets[sheet_name] = self._load_sheet(sheet_name)
+        # Callers (e.g. Account.calculate_balance) mutate their frames in place
+        return self._sheets[sheet_name].copy()
+
+    def fingerprint(self, sheet_name: str) -> str:
+        """Content hash of a single parsed sheet, independent of the rest of the workbook."""
+        if sheet_name not in self._fingerprints:
+            df = self.sheet(sheet_name)
+            digest = hashlib.sha256(repr(list(df.columns)).encode())
+            digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+            self._fingerprints[sheet_name] = digest.hexdigest()
+        return self._fingerprints[sheet_name]
+
+    def _load_sheet(self, sheet_name: str) -> pd.DataFrame:
+        if self.snapshots is not None:
+            df = self.snapshots.load(self.digest, sheet_name)
+            if df is not None:
+                self.snapshot_hits += 1
+                return df
+
+        df = (
+            self._workbook()
+            .parse(sheet_name)
+            .pipe(normalize_column_names)
+            .pipe(parse_dates)
+        )
+        self.parse_count += 1
+        logger.debug(f"Parsed sheet '{sheet_name}' ({self.parse_count} parses so far)")
+
+        if self.snapshots is not None:
+            self.snapshots.save(self.digest, sheet_name, df)
+        return df
+
+    def close(self):
+        if self._excel is not None:
+            self._excel.close()
+            self._excel = None
+
+
+def _as_source(table_path: Union[Path, WorkbookSource]) -> WorkbookSource:
+    if isinstance(table_path, WorkbookSource):
+        return table_path
+    return WorkbookSource(table_path)
+
+
+def create_holdings(table_path: Union[Path, WorkbookSource]):
+    source = _as_source(table_path)
+    if "Holdings" in source:
+        return source.sheet("Holdings")
     return None
 
-def create_accounts(table_path: Path):
-    data = pd.read_excel(table_path, sheet_name=None, engine='calamine')
+@dataclass
+class ReloadReport:
+    reused: list[str] = field(default_factory=list)
+    rebuilt: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+
+    def __str__(self):
+        return (
+            f"{len(self.reused)} accounts reused, {len(self.rebuilt)} rebuilt "
+            f"({', '.join(self.rebuilt) or 'none'}), {len(self.removed)} removed"
+        )
+
+
+def _account_fingerprint(source: WorkbookSource, row: pd.Series) -> str:
+    digest = hashlib.sha256(source.fingerprint(row["account_id"]).encode())
+    digest.update(repr({key: str(value) for key, value in row.items()}).encode())
+    return digest.hexdigest()
+
+
+def _holdings_fingerprint(source: WorkbookSource) -> str:
+    # Holdings are valued up to today, so the same sheet is stale on a new day
+    digest = hashlib.sha256(source.fingerprint("Holdings").encode())
+    digest.update(date.today().isoformat().encode())
+    return digest.hexdigest()
+
+
+def _build_account(source: WorkbookSource, row: pd.Series, validation: ValidationMode = "full") -> Account:
+    account_id = row["account_id"]
+    return Account(
+        account_id=account_id,
+        bank=row["bank"],
+        account_number=row["account_number"],
+        type=row["type"],
+        currency=row["currency"],
+        status=row["status"],
+        transactions=read_historical_data(source, account_id),
+        fingerprint=_account_fingerprint(source, row),
+        validation=validation,
+    )
+
+
+def _build_holdings(source: WorkbookSource) -> Account:
+    holdings_table = source.sheet("Holdings")
+    cube = holdings_cube(holdings_table, incremental=True)
+    return Account(
+        account_id="Holdings",
+        bank=None,
+        account_number=None,
+        type="Investment",
+        currency="GBP",
+        status="Active",
+        transactions=export_holdings(cube),
+        fingerprint=_holdings_fingerprint(source),
+        validation="trusted",
+        holdings=cube,
+    )
+
+
+def _load_account_chunk(
+    table_path,
+    snapshots: Optional[SnapshotStore],
+    digest: Optional[str],
+    rows: list[dict],
+    validation: ValidationMode,
+) -> tuple[list[Account], int, int]:
+    """Worker entry point: parse and validate a chunk of account sheets."""
+    if isinstance(table_path, bytes):
+        table_path = io.BytesIO(table_path)
+    source = WorkbookSource(table_path, snapshots=snapshots)
+    source._digest = digest
+    try:
+        accounts = [_build_account(source, pd.Series(row), validation) for row in rows]
+    finally:
+        source.close()
+    return accounts, source.parse_count, source.snapshot_hits
+
+
+def _build_accounts_parallel(
+    source: WorkbookSource,
+    accounts_table: pd.DataFrame,
+    workers: int,
+    validation: ValidationMode,
+    build_holdings: bool,
+) -> tuple[dict[str, Account], Optional[Account]]:
+    table_path = source.table_path
+    if not isinstance(table_path, (str, os.PathLike)):
+        table_path = workbook_bytes(table_path)
+    digest = source.digest if source.snapshots is not None else None
+
+    rows = accounts_table.to_dict("records")
+    chunks = [rows[i::workers] for i in range(workers) if rows[i::workers]]
+
+    # Spawn rather than fork: the dashboard and price fetchers run threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(chunks) or 1, mp_context=context) as executor:
+        futures = [
+            executor.submit(_load_account_chunk, table_path, source.snapshots, digest, chunk, validation)
+            for chunk in chunks
+        ]
+        # Holdings are mostly waiting on price providers, so build them while the pool works
+        holdings = _build_holdings(source) if build_holdings else None
+
+        built = {}
+        for future in futures:
+            accounts, parse_count, snapshot_hits = future.result()
+            source.parse_count += parse_count
+            source.snapshot_hits += snapshot_hits
+            built.update({account.account_id: account for account in accounts})
+
+    # Keep the order of the Accounts sheet regardless of how rows were chunked
+    return {row["account_id"]: built[row["account_id"]] for row in rows}, holdings
+
+
+def create_accounts(
+    table_path: Union[Path, WorkbookSource],
+    workers: int = 1,
+    validation: ValidationMode = "full",
+):
+    """
+    Build an AccountList from a workbook.
+
+    With ``workers > 1`` account sheets are parsed and validated across a
+    process pool; the resulting accounts are the same and in the same order
+    as a serial load. ``validation`` applies to the account sheets; the
+    generated Holdings account is always trusted.
+    """
+    source = _as_source(table_path)
     accounts_dict = {}
+    has_holdings = "Holdings" in source
+    holdings = None
 
-    if "Accounts" in data:
-        accounts_table = data["Accounts"].pipe(normalize_column_names)
+    if "Accounts" in source:
+        accounts_table = source.sheet("Accounts")
+        if workers > 1 and len(accounts_table) > 1:
+            accounts_dict, holdings = _build_accounts_parallel(
+                source, accounts_table, workers, validation, build_holdings=has_holdings
+            )
+        else:
+            for _, row in accounts_table.iterrows():
+                accounts_dict[row["account_id"]] = _build_account(source, row, validation)
+
+    if has_holdings:
+        accounts_dict["Holdings"] = holdings if holdings is not None else _build_holdings(source)
+
+    logger.info(
+        f"Loaded {len(accounts_dict)} accounts with {source.parse_count} sheet parses "
+        f"and {source.snapshot_hits} snapshot reads"
+    )
+    return AccountList(accounts_dict)
+
+
+def reload_accounts(
+    table_path: Union[Path, WorkbookSource],
+    previous: AccountList,
+    validation: ValidationMode = "full",
+) -> tuple[AccountList, ReloadReport]:
+    """
+    Reload a workbook that was previously loaded into ``previous``.
+
+    Accounts whose sheet and metadata fingerprints are unchanged are reused
+    as they are (no validation, balances kept); only changed or new
+    accounts, and Holdings valued with stale prices, are rebuilt. The
+    returned list carries over the previous balance matrix so that
+    ``calculate_balances`` only recomputes the columns of the rebuilt
+    accounts.
+    """
+    source = _as_source(table_path)
+    report = ReloadReport()
+    accounts_dict = {}
+
+    def reuse_or_build(account_id, fingerprint, build):
+        old = previous.get(account_id)
+        # Holdings valued with stale prices are rebuilt to pick up the finished refresh
+        stale = old is not None and old.holdings is not None and bool(old.holdings.stale_prices)
+        if old is not None and old.fingerprint == fingerprint and not stale:
+            report.reused.append(account_id)
+            return old
+        report.rebuilt.append(account_id)
+        return build()
+
+    if "Accounts" in source:
+        accounts_table = source.sheet("Accounts")
         for _, row in accounts_table.iterrows():
             account_id = row["account_id"]
-            transactions = read_historical_data(table_path, account_id)
-            accounts_dict[account_id] = Account(
-                account_id=account_id,
-                bank=row["bank"],
-                account_number=row["account_number"],
-                type=row["type"],
-                currency=row["currency"],
-                status=row["status"],
-                transactions=transactions,
+            accounts_dict[account_id] = reuse_or_build(
+                account_id,
+                _account_fingerprint(source, row),
+                lambda: _build_account(source, row, validation),
             )
 
-    if "Holdings" in data:
-        holdings_table = data["Holdings"].pipe(normalize_column_names)
-        transactions = get_historical_holdings(holdings_table)
-        accounts_dict["Holdings"] = Account(
-            account_id="Holdings",
-            bank=None,
-            account_number=None,
-            type="Investment",
-            currency="GBP",
-            status="Active",
-            transactions=transactions,
+    if "Holdings" in source:
+        accounts_dict["Holdings"] = reuse_or_build(
+            "Holdings",
+            _holdings_fingerprint(source),
+            lambda: _build_holdings(source),
         )
 
-    return AccountList(accounts_dict)
+    report.removed = [account_id for account_id in previous.get_ids() if account_id not in accounts_dict]
+
+    accounts = AccountList(accounts_dict)
+    accounts.carry_over_balances(previous)
+    logger.info(f"Reloaded workbook: {report}")
+    return accounts, report
 
 
-def read_historical_data(table_path: Path, account_id: str) -> pd.DataFrame:
+def read_historical_data(table_path: Union[Path, WorkbookSource], account_id: str) -> pd.DataFrame:
+    source = _as_source(table_path)
     try:
-        return (
-            pd.read_excel(table_path, sheet_name=account_id, engine='calamine')
-            .pipe(normalize_column_names)
-            .assign(date=lambda x: pd.to_datetime(x.date, dayfirst=True))
-        )
+        return source.sheet(account_id)
     except KeyError:
         raise ValueError(f"No data found for account_id='{account_id}'")
 
 
+def parse_dates(df: pd.DataFrame) -> pd.DataFrame:
+    if "date" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["date"]):
+        df = df.assign(date=pd.to_datetime(df["date"], dayfirst=True))
+    return df
+
+
 def normalize_column_names(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
     df.columns = [to_snake_case(col) for col in df.columns]
@@ -73,4 +356,3 @@ def to_snake_case(name: str) -> str:
     if re.match(r'^\d', name):
         name = f'col_{name}'
     return name
-
@@ -122,12 +122,8 @@ def plot_monthly_balance_bars(accounts, start_date, end_date, filepath: Path):
         Directory where to save plots
     """
 
-    # Ensure date index
-    df = accounts.merged_balances.copy()
-    df = df.loc[start_date:end_date]
-
-    # Compute month-end balances
-    monthly = df.resample('ME').last()
+    # Month-end balances from the precomputed rollup
+    monthly = accounts.rollup('ME', start_date, end_date)
 
     # Create a bar chart for each account
     for col in monthly.columns:
@@ -162,14 +158,8 @@ def plot_monthly_stacked_balance_by_bank(accounts, start_date, end_date, filepat
     Positive balances stack upward; negative balances stack downward.
     """
 
-    df = accounts.merged_balances.copy().loc[start_date:end_date]
-
-    # Exclude the total column if present
-    if "total" in df.columns:
-        df = df.drop(columns="total")
-
-    # Resample to month-end (use .last() to get end-of-month balances)
-    monthly = df.resample("ME").last()
+    # Month-end balances from the precomputed rollup, excluding the total column
+    monthly = accounts.rollup("ME", start_date, end_date).drop(columns="total")
 
     # Map each account_id to its bank
     account_to_bank = {acc.account_id: acc.bank for acc in accounts.values()}
@@ -242,7 +232,7 @@ def plot_monthly_stacked_balance_by_bank(accounts, start_date, end_date, filepat
     plt.close()
 
 def plot_monthly_diff(accounts: AccountList,  filepath: Path):
-    monthly_df = monthly_balance_difference(accounts.merged_balances)
+    monthly_df = monthly_balance_difference(accounts.rollup("ME"))
     monthly_df = monthly_df.sort_index().dropna(subset=['monthly_diff'])
 
     years = monthly_df.index.get_level_values("year").unique()
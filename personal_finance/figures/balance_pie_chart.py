@@ -48,8 +48,7 @@ def plot_account_balance_pie(accounts, selected_date):
     grouped by Bank -> Account, with per-bank color families.
     Holdings are subdivided by ticker and colored green/red.
     """
-    mb = accounts.merged_balances
-    monthly = mb[[col for col in mb.columns if col != "total"]].resample("ME").last()
+    monthly = accounts.rollup("ME").drop(columns="total")
     selected_date = pd.to_datetime(selected_date)
 
     possible_dates = monthly.index[monthly.index <= selected_date]
@@ -106,24 +105,18 @@ def plot_account_balance_pie(accounts, selected_date):
     if "Holdings" in positive_balances.index:
         holdings_acc = accounts["Holdings"]
         
-        tx_df = holdings_acc.transactions
-        past_tx = tx_df[pd.to_datetime(tx_df['date']).dt.date <= date.date()]
-        
+        latest = holdings_acc.holdings.on(date) if holdings_acc.holdings is not None else None
+
         holdings_sub_ids = []
         holdings_sub_labels = []
         holdings_sub_parents = []
         holdings_sub_values = []
         holdings_sub_colors = []
 
-        if not past_tx.empty:
-            latest = past_tx.iloc[-1]
-            cols_to_exclude = {"date", "balance", "transaction_number", "valuation"}
-            tickers = [c for c in tx_df.columns if c not in cols_to_exclude 
-                      and not c.endswith("_valuation") and not c.endswith("_invested")]
-            
-            for ticker in sorted(tickers):
-                inv_val = latest.get(f"{ticker}_invested", 0)
-                pnl = latest.get(ticker, 0)
+        if latest is not None:
+            for ticker, metrics in latest.sort_index().iterrows():
+                inv_val = metrics["invested"]
+                pnl = metrics["unrealized"]
                 if inv_val > 0:
                     holdings_sub_ids.append(f"Holdings_{ticker}")
                     holdings_sub_labels.append(ticker)
@@ -1,4 +1,3 @@
-import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
 
@@ -9,27 +8,18 @@ def plot_holdings_stacked(accounts, start_date, end_date):
     if "Holdings" not in accounts.get_ids():
         return None
 
-    holdings_acc = accounts["Holdings"]
-    df = holdings_acc.transactions.copy()
-    
-    # Ensure date is index
-    df['date'] = pd.to_datetime(df['date'])
-    df = df.set_index('date').sort_index()
-    
-    # Filter by date range
-    df = df.loc[start_date:end_date]
-
-    # Exclude non-ticker columns
-    cols_to_exclude = ["balance", "transaction_number", "valuation"]
-    ticker_cols = [c for c in df.columns if c not in cols_to_exclude and not c.endswith("_valuation") and not c.endswith("_invested")]
+    cube = accounts["Holdings"].holdings
+    if cube is None:
+        return None
+    unrealized = cube.frame("unrealized").loc[start_date:end_date]
 
     fig = go.Figure()
 
-    for ticker in ticker_cols:
+    for isin, ticker in zip(cube.isins, cube.labels):
         fig.add_trace(
             go.Scatter(
-                x=df.index,
-                y=df[ticker],
+                x=unrealized.index,
+                y=unrealized[isin],
                 mode='lines',
                 line=dict(width=0.5),
                 stackgroup='one',
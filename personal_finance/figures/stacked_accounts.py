@@ -19,15 +19,8 @@ def plot_stacked_ts_balance_by_bank(accounts, start_date, end_date):
     -------
     fig : plotly.graph_objects.Figure
     """
-    # Copy relevant data
-    df = accounts.merged_balances.copy().loc[start_date:end_date]
-
-    # Exclude total column
-    if "total" in df.columns:
-        df = df.drop(columns="total")
-
-    # Month-end resampling
-    monthly = df.resample("ME").last()
+    # Month-end balances from the precomputed rollup, excluding the total column
+    monthly = accounts.rollup("ME", start_date, end_date).drop(columns="total")
 
     # Map account_id → bank
     account_to_bank = {acc.account_id: acc.bank for acc in accounts.values()}
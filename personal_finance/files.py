@@ -0,0 +1,30 @@
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+# Reading the umask means setting it, so do it once while the module loads
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def atomic_write(path: Path, write: Callable[[str], None]):
+    """
+    Replace ``path`` with whatever ``write`` produces in a temporary file
+    beside it, so readers see either the old or the new file in full.
+
+    The temporary file is created private by ``mkstemp`` and opened up to
+    the usual ``0o666 & ~umask`` before it is renamed into place.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_name)
+        os.chmod(tmp_name, 0o666 & ~_UMASK)
+        os.replace(tmp_name, path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
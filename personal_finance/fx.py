@@ -0,0 +1,82 @@
+import logging
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from personal_finance.intervals import Interval, merge_intervals
+from personal_finance.price_store import PriceStore, shared_price_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FX_DIR = Path(".cache") / "fx"
+
+# Quotes in pence are converted without an FX rate
+PENCE_CURRENCIES = ("GBp", "GBX")
+
+
+def fx_pair(currency: str) -> str:
+    return f"{currency}GBP=X"
+
+
+def _needs_rate(currency: Optional[str]) -> bool:
+    return bool(currency) and currency != "GBP" and currency not in PENCE_CURRENCIES
+
+
+class FxRates:
+    """
+    Rates to GBP shared by every price series of a run.
+
+    Price fetchers ``require`` the currency and date range of each series
+    they return; ``fetch`` then downloads each currency pair at most once,
+    covering only the days its ``PriceStore`` has not seen before, and
+    ``to_gbp`` converts a series with the cached rates.
+    """
+
+    def __init__(self, store: Optional[PriceStore] = None):
+        self.store = store if store is not None else shared_price_store(DEFAULT_FX_DIR)
+        self._required: dict[str, list[Interval]] = {}
+
+    def require(self, currency: Optional[str], start_date, end_date):
+        if _needs_rate(currency):
+            interval = (pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize())
+            self._required.setdefault(currency, []).append(interval)
+
+    def fetch(self, providers: list):
+        """
+        Download the missing rates of every required pair, one request per
+        pair, from the first of ``providers`` that has them.
+        """
+        for currency, intervals in sorted(self._required.items()):
+            pair = fx_pair(currency)
+            gaps = self.store.gaps(pair, merge_intervals(intervals))
+            if not gaps:
+                continue
+            rates = pd.Series(dtype=float)
+            for provider in providers:
+                try:
+                    rates = provider.fetch_fx(currency, gaps[0][0], gaps[-1][1])
+                except Exception as e:
+                    logger.warning(f"FX fetch of {pair} from {provider.name} failed: {e}")
+                    continue
+                if not rates.empty:
+                    break
+
+            if not rates.empty:
+                self.store.append(pair, rates)
+            self.store.record_coverage(pair, gaps, missing=gaps if rates.empty else [])
+        self._required.clear()
+
+    def to_gbp(self, series: pd.Series, currency: Optional[str]) -> pd.Series:
+        if currency in PENCE_CURRENCIES:
+            return series / 100
+        if not _needs_rate(currency) or series.empty:
+            return series
+
+        rates = self.store.read(fx_pair(currency)).dropna()
+        if rates.empty:
+            logger.warning(f"No {fx_pair(currency)} rates available, leaving prices in {currency}")
+            return series
+        # Rates on non-trading days come from the closest earlier (or, failing that, later) fix
+        aligned = rates.reindex(rates.index.union(series.index)).ffill().bfill().reindex(series.index)
+        return series * aligned.to_numpy()
@@ -1,254 +1,408 @@
+import hashlib
 import logging
+import math
 import os
-from dotenv import load_dotenv
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass
 from datetime import datetime
+from typing import Literal, Optional, Sequence, Union
 
 import numpy as np
 import pandas as pd
-import requests
-import yfinance as yf
+
+from personal_finance.calendars import exchange_for, trading_calendar
+from personal_finance.fx import DEFAULT_FX_DIR, FxRates
+from personal_finance.holdings_cube import HoldingsCube
+from personal_finance.holdings_state import DEFAULT_HOLDINGS_STATE_DIR, HoldingsState, HoldingsStateStore
+from personal_finance.intervals import ONE_DAY, Interval, merge_intervals
+from personal_finance.output import NullSink, OutputSink, output_sink, write_in_background
+from personal_finance.price_store import DEFAULT_PRICE_DIR, PriceStore, default_price_store, shared_price_store
+from personal_finance.providers import DEFAULT_CACHE_DIR, PriceProvider, PriceRequest, chain_cache_dir, fetch_from_chain, provider_chain
 
 logger = logging.getLogger(__name__)
 
-def _calculate_invested(group: pd.DataFrame) -> pd.Series:
-    group = group.sort_values("date")
-    avg_cost = 0.0
-    current_shares = 0.0
-    
-    records = []
-    for _, row in group.iterrows():
-        shares_transacted = row["shares"]
-        price = row["price"]
-        date = row["date"]
-        
-        if shares_transacted > 0:
-            total_cost = (current_shares * avg_cost) + (shares_transacted * price)
-            current_shares += shares_transacted
-            avg_cost = total_cost / current_shares if current_shares > 0 else 0
+# Shares at or below this are treated as a fully closed position
+CLOSED_POSITION_EPSILON = 1e-6
+
+CostMethod = Literal["average", "fifo"]
+
+# Seconds to wait for fresh prices before serving cached ones; "inf" waits for every fetch
+PRICE_DEADLINE_ENV = "PRICE_DEADLINE"
+DEFAULT_PRICE_DEADLINE = 30.0
+
+# Refreshes run here, one at a time, and finish even when their caller stopped waiting
+_price_refreshes = ThreadPoolExecutor(max_workers=1, thread_name_prefix="price-refresh")
+# The refresh still fetching each (store, ISIN), so later calls neither queue nor wait for it again
+_refreshing: dict[tuple[PriceStore, str], Future] = {}
+_refreshing_lock = threading.Lock()
+
+
+def _segment_cumsum(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Cumulative sum that restarts at every row where ``starts`` is True."""
+    # A grouped cumsum rather than differences of one global cumsum, which
+    # would lose precision across segments of very different magnitudes
+    return pd.Series(values).groupby(np.cumsum(starts)).cumsum().to_numpy()
+
+
+def _isin_starts(isin_codes: np.ndarray) -> np.ndarray:
+    starts = np.ones(len(isin_codes), dtype=bool)
+    starts[1:] = isin_codes[1:] != isin_codes[:-1]
+    return starts
+
+
+def _previous_in_isin(values: np.ndarray, isin_starts: np.ndarray) -> np.ndarray:
+    """Value of the previous row of the same ISIN (0 on each ISIN's first row)."""
+    previous = np.roll(values, 1)
+    previous[isin_starts] = 0.0
+    return previous
+
+
+def _average_cost_invested(
+    isin_codes: np.ndarray,
+    shares: np.ndarray,
+    prices: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Shares held and invested amount (shares held x average cost) after each
+    transaction.
+
+    Rows must be sorted by ISIN and date. Buys add ``shares * price`` to the
+    invested amount; sells keep the average cost, so they scale the invested
+    amount by the fraction of shares still held; a sell that leaves
+    ``CLOSED_POSITION_EPSILON`` shares or less closes the position and resets
+    both shares and average cost.
+
+    This is a scalar loop that carries the running totals over plain lists
+    in one pass. It replaces a NumPy version built on segmented cumsums of
+    log sell ratios, which lost precision across resets and underflowed to
+    NaN for positions repeatedly bought and then mostly sold again.
+    """
+    starts = _isin_starts(isin_codes).tolist()
+    held = [0.0] * len(starts)
+    invested = [0.0] * len(starts)
+    current_shares = current_cost = 0.0
+    for k, (start, quantity, price) in enumerate(zip(starts, shares.tolist(), prices.tolist())):
+        if start:
+            current_shares = current_cost = 0.0
+        if quantity > 0:
+            current_shares += quantity
+            current_cost += quantity * price
         else:
-            current_shares += shares_transacted
-            if current_shares <= 1e-6:
-                current_shares = 0
-                avg_cost = 0
-                
-        records.append({"date": date, "invested": current_shares * avg_cost})
-        
-    return pd.DataFrame(records).groupby("date")["invested"].last()
-
-def _fetch_from_yf(yf_name: str, start_date: datetime, end_date: datetime) -> pd.Series:
-    try:
-        t = yf.Ticker(yf_name)
-        # Add 1 day to end_date to ensure inclusive fetching
-        data = t.history(start=start_date, end=end_date + pd.Timedelta(days=1))
-        if data.empty:
-            return pd.Series(dtype=float)
-            
-        data.index = data.index.tz_localize(None).normalize()
-        series = data["Close"]
-        
-        currency = t.fast_info.get("currency", "GBP")
-        if currency == "GBp":
-            series = series / 100
-        elif currency and currency != "GBP":
-            fx_ticker = f"{currency}GBP=X"
-            fx_data = yf.download(fx_ticker, start=start_date, end=end_date + pd.Timedelta(days=1), progress=False)
-            if not fx_data.empty:
-                fx_series = fx_data["Adj Close"] if "Adj Close" in fx_data.columns else fx_data["Close"]
-                if isinstance(fx_series, pd.DataFrame):
-                    fx_series = fx_series.iloc[:, 0]
-                fx_series.index = fx_series.index.tz_localize(None).normalize()
-                fx_series = fx_series.reindex(series.index).ffill().bfill()
-                series = series * fx_series
-                
-        return series
-    except Exception as e:
-        logger.warning(f"YF fetch failed for {yf_name}: {e}")
-        return pd.Series(dtype=float)
-
-
-def _fetch_from_eodhd(isin: str, start_date: datetime, end_date: datetime) -> pd.Series:
-    load_dotenv()
-    api_key = os.environ.get("EODHD_API_KEY")
-    if not api_key:
-        return pd.Series(dtype=float)
-        
-    try:
-        search_url = f"https://eodhd.com/api/search/{isin}?api_token={api_key}&fmt=json"
-        search_resp = requests.get(search_url)
-        search_resp.raise_for_status()
-        search_data = search_resp.json()
-        if not search_data:
-            return pd.Series(dtype=float)
-            
-        eod_ticker = search_data[0]["Code"] + "." + search_data[0]["Exchange"]
-        currency = search_data[0].get("Currency", "GBP")
-        
-        eod_url = f"https://eodhd.com/api/eod/{eod_ticker}?from={start_date.strftime('%Y-%m-%d')}&to={end_date.strftime('%Y-%m-%d')}&api_token={api_key}&fmt=json"
-        eod_resp = requests.get(eod_url)
-        eod_resp.raise_for_status()
-        eod_data = eod_resp.json()
-        
-        if not eod_data:
-            return pd.Series(dtype=float)
-            
-        df = pd.DataFrame(eod_data)
-        df["date"] = pd.to_datetime(df["date"])
-        df.set_index("date", inplace=True)
-        series = df["adjusted_close"] if "adjusted_close" in df.columns else df["close"]
-        
-        if currency == "GBX":
-            series = series / 100
-        elif currency and currency != "GBP":
-            fx_ticker = f"{currency}GBP=X"
-            fx_data = yf.download(fx_ticker, start=start_date, end=end_date + pd.Timedelta(days=1), progress=False)
-            if not fx_data.empty:
-                fx_series = fx_data["Adj Close"] if "Adj Close" in fx_data.columns else fx_data["Close"]
-                if isinstance(fx_series, pd.DataFrame):
-                    fx_series = fx_series.iloc[:, 0]
-                fx_series.index = fx_series.index.tz_localize(None).normalize()
-                fx_series = fx_series.reindex(series.index).ffill().bfill()
-                series = series * fx_series
-                
-        return series
-    except Exception as e:
-        logger.warning(f"EODHD fetch failed for ISIN {isin}: {e}")
-        return pd.Series(dtype=float)
-
-
-def _get_required_dates(group: pd.DataFrame, end_date: datetime) -> pd.DatetimeIndex:
-    daily_shares = group.groupby("date")["shares"].sum()
-    first_date = daily_shares.index.min()
-    full_range = pd.date_range(first_date, end_date, freq="D")
-    
-    cum_shares = daily_shares.reindex(full_range, fill_value=0).cumsum()
-    # Epsilon for float comparisons
-    required = cum_shares[cum_shares > 1e-6].index
-    
-    tx_dates = daily_shares[daily_shares != 0].index
-    required = required.union(tx_dates)
-    
-    return required.sort_values()
+            remaining = current_shares + quantity
+            if remaining <= CLOSED_POSITION_EPSILON:
+                current_shares = current_cost = 0.0
+            else:
+                current_cost *= remaining / current_shares
+                current_shares = remaining
+        held[k] = current_shares
+        invested[k] = current_cost
+    return np.array(held, dtype=float), np.array(invested, dtype=float)
 
 
-def _get_contiguous_ranges(dates: pd.DatetimeIndex, max_gap_days: int = 7):
-    if len(dates) == 0:
-        return []
-    
-    ranges = []
-    start_date = dates[0]
-    diffs = dates.to_series().diff()
-    
-    for i in range(1, len(dates)):
-        if diffs.iloc[i].days > max_gap_days:
-            end_date = dates[i-1]
-            ranges.append((start_date, end_date))
-            start_date = dates[i]
-            
-    ranges.append((start_date, dates[-1]))
-    return ranges
+def _fifo_cost_basis(
+    isin_codes: np.ndarray,
+    shares: np.ndarray,
+    prices: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Shares held, invested amount, shares consumed from the lot queue and
+    their cost after each transaction under FIFO lot matching.
 
+    Each ISIN's lot queue is the array of its buys: cumulative shares bought
+    and cumulative cost bought. Selling consumes the queue from its head, so
+    the cost of the first ``q`` shares ever sold is read off the cumulative
+    arrays with one binary search, and the head of the queue after any
+    transaction is where the cumulative shares sold fall in it. Shares sold
+    beyond what has been bought are discarded, as in the average-cost
+    engine. Positions left with ``CLOSED_POSITION_EPSILON`` shares or less
+    are reported as closed; the residual stays at the head of the queue.
+    """
+    n_rows = len(shares)
+    isin_starts = _isin_starts(isin_codes)
+    is_buy = shares > 0
 
-def get_historical_holdings(
+    bought = _segment_cumsum(np.where(is_buy, shares, 0.0), isin_starts)
+    bought_cost = _segment_cumsum(np.where(is_buy, shares * prices, 0.0), isin_starts)
+    sold = _segment_cumsum(np.where(is_buy, 0.0, -shares), isin_starts)
+    discarded = (
+        pd.Series(np.maximum(sold - bought, 0.0))
+        .groupby(np.cumsum(isin_starts))
+        .cummax()
+        .to_numpy()
+    )
+    consumed = sold - discarded
+
+    consumed_cost = np.zeros(n_rows)
+    bounds = np.append(np.flatnonzero(isin_starts), n_rows)
+    for first, stop in zip(bounds[:-1], bounds[1:]):
+        buys = is_buy[first:stop]
+        if not buys.any():
+            continue
+        lot_ends = bought[first:stop][buys]
+        lot_cost_ends = bought_cost[first:stop][buys]
+        lot_prices = prices[first:stop][buys]
+        head = np.minimum(np.searchsorted(lot_ends, consumed[first:stop], side="left"), len(lot_ends) - 1)
+        consumed_cost[first:stop] = lot_cost_ends[head] - (lot_ends[head] - consumed[first:stop]) * lot_prices[head]
+
+    held = bought - consumed
+    invested = bought_cost - consumed_cost
+    closed = held <= CLOSED_POSITION_EPSILON
+    return np.where(closed, 0.0, held), np.where(closed, 0.0, invested), consumed, consumed_cost
+
+
+def _cost_basis(
+    isin_codes: np.ndarray,
+    shares: np.ndarray,
+    prices: np.ndarray,
+    method: CostMethod = "average",
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Shares held, invested amount and realized P&L of each transaction."""
+    isin_starts = _isin_starts(isin_codes)
+    is_sell = shares <= 0
+    if method == "average":
+        held, invested = _average_cost_invested(isin_codes, shares, prices)
+        sold = np.minimum(-shares, _previous_in_isin(held, isin_starts))
+        cost_of_sold = _previous_in_isin(invested, isin_starts) - invested
+    elif method == "fifo":
+        held, invested, consumed, consumed_cost = _fifo_cost_basis(isin_codes, shares, prices)
+        sold = consumed - _previous_in_isin(consumed, isin_starts)
+        cost_of_sold = consumed_cost - _previous_in_isin(consumed_cost, isin_starts)
+    else:
+        raise ValueError(f"Unknown cost method '{method}'")
+    realized = np.where(is_sell, sold * prices - cost_of_sold, 0.0)
+    return held, invested, realized
+
+
+def _sorted_transactions(table: pd.DataFrame):
+    rows = table[["isin", "date", "shares", "price"]].sort_values(["isin", "date"], kind="stable")
+    isins, isin_codes = np.unique(rows["isin"].to_numpy(), return_inverse=True)
+    return (
+        isins,
+        isin_codes,
+        pd.DatetimeIndex(rows["date"]).to_numpy(),
+        rows["shares"].to_numpy(dtype=float),
+        rows["price"].to_numpy(dtype=float),
+    )
+
+
+def _daily_matrix(
+    isins: np.ndarray,
+    isin_codes: np.ndarray,
+    dates: np.ndarray,
+    values: np.ndarray,
+    date_range: pd.DatetimeIndex,
+) -> pd.DataFrame:
+    """Spread per-transaction values to a daily ISIN matrix, keeping each day's last value."""
+    last = np.ones(len(values), dtype=bool)
+    last[:-1] = (isin_codes[1:] != isin_codes[:-1]) | (dates[1:] != dates[:-1])
+
+    transaction_dates = pd.DatetimeIndex(np.unique(dates[last]))
+    matrix = np.full((len(transaction_dates), len(isins)), np.nan)
+    matrix[transaction_dates.get_indexer(dates[last]), isin_codes[last]] = values[last]
+    return (
+        pd.DataFrame(matrix, index=transaction_dates, columns=isins)
+        .reindex(date_range)
+        .ffill()
+        .fillna(0)
+    )
+
+
+def _invested_matrix(
     table: pd.DataFrame,
-    end_date: datetime = None
+    date_range: pd.DatetimeIndex,
+    method: CostMethod = "average",
 ) -> pd.DataFrame:
-    if end_date is None:
-        end_date = datetime.now()
+    """Daily invested amount per ISIN over ``date_range``."""
+    isins, isin_codes, dates, shares, prices = _sorted_transactions(table)
+    _, invested, _ = _cost_basis(isin_codes, shares, prices, method)
+    return _daily_matrix(isins, isin_codes, dates, invested, date_range)
 
-    table = table.assign(Date=pd.to_datetime(table["date"]))
-    start_date = table["date"].min()
-    date_range = pd.date_range(start_date, end_date, freq="D")
-    
-    table["isin"] = table["isin"].astype(str)
-    isin_names = table.groupby("isin")["full_name"].first().to_dict()
 
-    cache_path = "price_cache.csv"
-    if os.path.exists(cache_path):
-        cache_df = pd.read_csv(cache_path, parse_dates=["date"])
-    else:
-        cache_df = pd.DataFrame(columns=["date", "isin", "close"])
-        
-    cache_df["date"] = pd.to_datetime(cache_df["date"])
-    price_data_dict = {}
-    new_data_list = []
-    
-    for isin, group in table.groupby("isin"):
-        asset_start_date = group["date"].min()
-        full_range = pd.date_range(asset_start_date, end_date, freq="D")
-        required_dates = _get_required_dates(group, end_date)
-        
-        merged_series = pd.Series(dtype=float)
-        
-        if isin in cache_df["isin"].values:
-            asset_cache = cache_df[cache_df["isin"] == isin].copy()
-            asset_cache.set_index("date", inplace=True)
-            merged_series = asset_cache["close"]
-            
-            # In case cache has duplicates, keep last
-            merged_series = merged_series[~merged_series.index.duplicated(keep="last")]
-        
-        missing_dates = required_dates.difference(merged_series.index)
-        
-        if not missing_dates.empty:
-            yf_names = group["yf_name"].dropna().unique()
-            primary_yf_name = yf_names[0] if len(yf_names) > 0 else None
-            
-            all_fetched = pd.Series(dtype=float)
-            
-            for block_start, block_end in _get_contiguous_ranges(missing_dates, max_gap_days=7):
-                fetched_prices = pd.Series(dtype=float)
-                if primary_yf_name:
-                    fetched_prices = _fetch_from_yf(primary_yf_name, block_start, block_end)
-                    
-                if fetched_prices.empty:
-                    fetched_prices = _fetch_from_eodhd(isin, block_start, block_end)
-                    
-                if fetched_prices.empty:
-                    logger.warning(f"Could not fetch prices from YF or EODHD for ISIN {isin} between {block_start.date()} and {block_end.date()}.")
-                else:
-                    all_fetched = pd.concat([all_fetched, fetched_prices])
-
-            if not all_fetched.empty:
-                all_fetched = all_fetched[~all_fetched.index.duplicated(keep="last")]
-                merged_series = pd.concat([merged_series, all_fetched])
-                merged_series = merged_series[~merged_series.index.duplicated(keep="last")]
-                
-                new_data = all_fetched.reset_index()
-                new_data.columns = ["date", "close"]
-                new_data["isin"] = isin
-                new_data_list.append(new_data)
-
-            unfetched_dates = missing_dates.difference(all_fetched.index) if not all_fetched.empty else missing_dates
-            if not unfetched_dates.empty:
-                unfetched_data = pd.DataFrame({
-                    "date": unfetched_dates,
-                    "isin": isin,
-                    "close": np.nan
-                })
-                new_data_list.append(unfetched_data)
-                
-        # Forward fill over the full possible range. This perfectly carries cache NaNs 
-        # as well as bridging any gaps where there was no holding.
-        merged_series = merged_series.reindex(full_range).ffill()
-        
-        # Fallback to cost basis for remaining NaNs
-        if merged_series.isna().any():
-            cost_series = group.set_index("date")["price"]
-            cost_series = cost_series[~cost_series.index.duplicated(keep="last")].reindex(full_range).ffill()
-            merged_series = merged_series.fillna(cost_series)
-            
-        merged_series = merged_series.bfill()
-        price_data_dict[isin] = merged_series
-        
-    price_data = pd.DataFrame(price_data_dict).reindex(date_range).ffill()
-    
-    if new_data_list:
-        new_data_df = pd.concat(new_data_list, ignore_index=True)
-        updated_cache = pd.concat([cache_df, new_data_df], ignore_index=True)
-        updated_cache.drop_duplicates(subset=["date", "isin"], keep="last", inplace=True)
-        updated_cache.sort_values(["isin", "date"]).to_csv(cache_path, index=False)
+@dataclass
+class ProfitAndLoss:
+    shares: pd.DataFrame
+    invested: pd.DataFrame
+    realized: pd.DataFrame
+    unrealized: pd.DataFrame
+
+
+def calculate_pnl(
+    table: pd.DataFrame,
+    prices: pd.DataFrame,
+    method: CostMethod = "fifo",
+) -> ProfitAndLoss:
+    """
+    Daily shares, invested amount, cumulative realized P&L and unrealized
+    P&L per ISIN, over the dates of ``prices`` (a dates x ISIN frame such as
+    the valuation prices used by ``get_historical_holdings``).
+    """
+    isins, isin_codes, dates, shares, prices_paid = _sorted_transactions(table)
+    held, invested, realized = _cost_basis(isin_codes, shares, prices_paid, method)
+    realized = _segment_cumsum(realized, _isin_starts(isin_codes))
+
+    date_range = pd.DatetimeIndex(prices.index)
+    shares_matrix = _daily_matrix(isins, isin_codes, dates, held, date_range)
+    invested_matrix = _daily_matrix(isins, isin_codes, dates, invested, date_range)
+    return ProfitAndLoss(
+        shares=shares_matrix,
+        invested=invested_matrix,
+        realized=_daily_matrix(isins, isin_codes, dates, realized, date_range),
+        unrealized=shares_matrix * prices.reindex(columns=isins) - invested_matrix,
+    )
+
+
+def _required_intervals(group: pd.DataFrame, end_date: pd.Timestamp) -> list[Interval]:
+    """Day intervals an asset needs prices for: every day it is held plus its transaction days."""
+    daily_shares = group.groupby("date")["shares"].sum()
+    dates = pd.DatetimeIndex(daily_shares.index).normalize()
+    held = daily_shares.cumsum().to_numpy() > CLOSED_POSITION_EPSILON
+    # A position opened on one transaction day is held until the day before the next one
+    until = dates[1:].append(pd.DatetimeIndex([end_date + ONE_DAY])) - ONE_DAY
+
+    intervals = [(start, end) for start, end, is_held in zip(dates, until, held) if is_held]
+    intervals += [(day, day) for day in dates[daily_shares.to_numpy() != 0]]
+    return [
+        (start, min(end, end_date))
+        for start, end in merge_intervals(intervals)
+        if start <= end_date
+    ]
+
 
-    # Calculate historical shares per ISIN
+def _fetch_blocks(
+    blocks: list[PriceRequest],
+    providers: list[PriceProvider],
+    max_workers: int,
+    fx_rates: Optional[FxRates] = None,
+) -> list[pd.Series]:
+    """
+    Fetch all blocks from the provider chain and convert them to GBP;
+    results come back in the order of ``blocks``.
+
+    Each provider runs its requests concurrently on a shared thread pool
+    and only gets the blocks earlier providers returned nothing for. FX
+    rates are fetched afterwards, once per currency for all blocks.
+    """
+    if not blocks:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(blocks)))) as executor:
+        quotes = fetch_from_chain(providers, blocks, executor)
+
+    if fx_rates is None:
+        fx_rates = FxRates(shared_price_store(chain_cache_dir(providers) / DEFAULT_FX_DIR.name))
+    for series, currency in quotes:
+        if not series.empty:
+            fx_rates.require(currency, series.index.min(), series.index.max())
+    fx_rates.fetch(providers)
+    return [fx_rates.to_gbp(series, currency) for series, currency in quotes]
+
+
+def _refresh_prices(
+    blocks: list[PriceRequest],
+    price_store: PriceStore,
+    providers: list[PriceProvider],
+    max_workers: int,
+    fx_rates: Optional[FxRates] = None,
+):
+    """Fetch ``blocks`` into ``price_store``, recording what could not be fetched."""
+    # A refresh queued behind one that overran its deadline skips what that one already fetched
+    blocks = [block for block in blocks if price_store.gaps(block.isin, [(block.start, block.end)])]
+    fetched_blocks = _fetch_blocks(blocks, providers, max_workers, fx_rates)
+
+    # Merge in planning order so the store does not depend on which fetch finished first
+    fetched_by_isin: dict[str, list[tuple[PriceRequest, pd.Series]]] = {}
+    for block, fetched_prices in zip(blocks, fetched_blocks):
+        fetched_by_isin.setdefault(block.isin, []).append((block, fetched_prices))
+
+    for isin, results in fetched_by_isin.items():
+        fetched = []
+        unfetched_blocks = []
+        for block, fetched_prices in results:
+            if fetched_prices.empty:
+                logger.warning(f"Could not fetch prices from YF or EODHD for ISIN {isin} between {block.start.date()} and {block.end.date()}.")
+                unfetched_blocks.append((block.start, block.end))
+            else:
+                fetched.append(fetched_prices)
+
+        if fetched:
+            all_fetched = pd.concat(fetched)
+            price_store.append(isin, all_fetched[~all_fetched.index.duplicated(keep="last")])
+
+        # Unfetchable blocks are recorded as known-missing so they are not requested again
+        price_store.record_coverage(isin, [(block.start, block.end) for block, _ in results], missing=unfetched_blocks)
+
+
+def _price_deadline(deadline: Optional[float]) -> Optional[float]:
+    """Seconds to wait for a refresh, or None to wait until it finishes."""
+    if deadline is None:
+        deadline = float(os.environ.get(PRICE_DEADLINE_ENV, DEFAULT_PRICE_DEADLINE))
+    if not math.isfinite(deadline):
+        return None
+    return max(deadline, 0.0)
+
+
+def _start_refresh(
+    blocks: list[PriceRequest],
+    price_store: PriceStore,
+    providers: list[PriceProvider],
+    max_workers: int,
+    fx_rates: Optional[FxRates] = None,
+) -> tuple[Optional[Future], dict[str, Future]]:
+    """
+    Submit a refresh of the ``blocks`` whose ISIN no earlier refresh of
+    ``price_store`` is still fetching. Returns that refresh, if any, and the
+    running refresh of each ISIN that was left to it.
+    """
+    with _refreshing_lock:
+        running = {
+            block.isin: _refreshing[price_store, block.isin]
+            for block in blocks
+            if (price_store, block.isin) in _refreshing
+        }
+        blocks = [block for block in blocks if block.isin not in running]
+        if not blocks:
+            return None, running
+        refresh = _price_refreshes.submit(_refresh_prices, blocks, price_store, providers, max_workers, fx_rates)
+        isins = {block.isin for block in blocks}
+        _refreshing.update({(price_store, isin): refresh for isin in isins})
+
+    def forget(done: Future):
+        with _refreshing_lock:
+            for isin in isins:
+                if _refreshing.get((price_store, isin)) is done:
+                    del _refreshing[price_store, isin]
+    refresh.add_done_callback(forget)
+    return refresh, running
+
+
+def wait_for_price_refreshes(timeout: Optional[float] = None):
+    """Block until price refreshes that overran their deadline have finished."""
+    _price_refreshes.submit(lambda: None).result(timeout=timeout)
+
+
+def _valuation_prices(group: pd.DataFrame, prices: pd.Series, end_date) -> pd.Series:
+    """Daily price of one ISIN from its first transaction, falling back to the cost price."""
+    full_range = pd.date_range(group["date"].min(), end_date, freq="D")
+
+    # Forward fill over the full possible range. This carries prices over
+    # known-missing days as well as bridging any gaps where there was no holding.
+    merged_series = prices.reindex(full_range).ffill()
+
+    # Fallback to cost basis for remaining NaNs
+    if merged_series.isna().any():
+        cost_series = group.set_index("date")["price"]
+        cost_series = cost_series[~cost_series.index.duplicated(keep="last")].reindex(full_range).ffill()
+        merged_series = merged_series.fillna(cost_series)
+
+    return merged_series.bfill()
+
+
+def _holdings_matrices(
+    table: pd.DataFrame,
+    date_range: pd.DatetimeIndex,
+    cost_method: CostMethod,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Daily shares held and invested amount per ISIN over ``date_range``."""
     holdings = (
         table.groupby(["isin", "date"])["shares"]
         .sum()
@@ -260,40 +414,207 @@ def get_historical_holdings(
         .ffill()
         .fillna(0)
     )
+    return holdings, _invested_matrix(table, date_range, cost_method)
 
-    # Calculate historical invested amount per ISIN
-    invested_series_list = []
-    for isin, group in table.groupby("isin"):
-        s = _calculate_invested(group)
-        s.name = isin
-        invested_series_list.append(s)
-        
-    invested_df = pd.concat(invested_series_list, axis=1) if invested_series_list else pd.DataFrame()
-    invested = (
-        invested_df
-        .reindex(date_range)
-        .ffill()
-        .fillna(0)
-    )
 
-    valuation_matrix = holdings.mul(price_data)
-    unrealized_matrix = valuation_matrix - invested
+def _transaction_fingerprints(groups: dict[str, pd.DataFrame]) -> dict[str, str]:
+    """Digest of each ISIN's transactions, in the order they are applied."""
+    return {
+        isin: hashlib.sha256(
+            pd.util.hash_pandas_object(group[["date", "shares", "price"]], index=False).to_numpy().tobytes()
+        ).hexdigest()
+        for isin, group in groups.items()
+    }
+
 
-    val_df = valuation_matrix.rename(columns=lambda x: f"{isin_names.get(x, x)}_valuation")
-    inv_df = invested.rename(columns=lambda x: f"{isin_names.get(x, x)}_invested")
+def holdings_cube(
+    table: pd.DataFrame,
+    end_date: datetime = None,
+    cost_method: CostMethod = "average",
+    price_store: Optional[PriceStore] = None,
+    max_workers: int = 8,
+    providers: Optional[Sequence[Union[str, PriceProvider]]] = None,
+    fx_rates: Optional[FxRates] = None,
+    deadline: Optional[float] = None,
+    incremental: bool = False,
+    holdings_state: Optional[HoldingsStateStore] = None,
+    dtype=np.float64,
+) -> HoldingsCube:
+    """
+    Daily unrealized P&L, valuation and invested amount of every ISIN in
+    ``table``, stored as ``dtype``.
+
+    Missing prices are fetched for at most ``deadline`` seconds (default
+    ``PRICE_DEADLINE`` or 30). Past that the cached prices are used, the
+    fetched ISINs are listed in ``cube.stale_prices``, and the refresh
+    carries on in the background so a later call finds it cached. ISINs
+    that such a refresh is still fetching are served cached prices at once.
+
+    With ``incremental`` the daily matrices are saved to ``holdings_state``
+    in the background and extended by the next call: only ISINs whose
+    transactions changed or include days past the saved ones are
+    recomputed, and only those or ones with newly fetched (or previously
+    stale) prices are repriced; every other ISIN just gains the new days.
+    """
+    if end_date is None:
+        end_date = datetime.now()
+    chain = provider_chain(providers)
+    # Stores left to default are the ones of this provider chain
+    cache_dir = chain_cache_dir(chain)
+    if price_store is None:
+        if cache_dir == DEFAULT_CACHE_DIR:
+            price_store = default_price_store()
+        else:
+            price_store = shared_price_store(cache_dir / DEFAULT_PRICE_DIR.name)
+    if fx_rates is None:
+        fx_rates = FxRates(shared_price_store(cache_dir / DEFAULT_FX_DIR.name))
+
+    table = table.assign(Date=pd.to_datetime(table["date"]))
+    start_date = table["date"].min()
+    date_range = pd.date_range(start_date, end_date, freq="D")
     
-    output = (
-        pd.concat([unrealized_matrix, val_df, inv_df], axis=1)
-        .assign(**{
-            "balance": invested.sum(axis=1),
-            "valuation": valuation_matrix.sum(axis=1),
-            "transaction_number": np.arange(1, 1+len(holdings))
-        })
-        .rename(columns=isin_names)
-        .rename_axis("date")
-        .reset_index()
+    table["isin"] = table["isin"].astype(str)
+    isin_names = table.groupby("isin")["full_name"].first().to_dict()
+
+    groups = dict(list(table.groupby("isin")))
+    cached_prices = {}
+    blocks = []
+
+    for isin, group in groups.items():
+        asset_start_date = group["date"].min()
+        required = _required_intervals(group, pd.Timestamp(end_date).normalize())
+        cached_prices[isin] = price_store.read(isin, asset_start_date, end_date)
+
+        yf_names = group["yf_name"].dropna().unique()
+        primary_yf_name = yf_names[0] if len(yf_names) > 0 else None
+
+        # Only trading days can have a price: gaps made of weekends and
+        # holidays alone (e.g. a refresh on a Sunday) need no request
+        calendar = trading_calendar(exchange_for(primary_yf_name))
+        missing_ranges = calendar.trim(price_store.gaps(isin, required))
+        if missing_ranges:
+            # Missing ranges less than a week apart are fetched as one block
+            blocks += [
+                PriceRequest(isin, primary_yf_name, block_start, block_end)
+                for block_start, block_end in merge_intervals(missing_ranges, max_gap_days=7)
+            ]
+
+    stale_isins = []
+    if blocks:
+        deadline = _price_deadline(deadline)
+        refresh, running = _start_refresh(blocks, price_store, chain, max_workers, fx_rates)
+        stale = set()
+        if refresh is not None:
+            try:
+                refresh.result(timeout=deadline)
+            except TimeoutError:
+                stale = {block.isin for block in blocks} - set(running)
+                logger.warning(f"Price refresh of {len(stale)} ISINs passed its {deadline:g}s deadline; serving cached prices")
+        # A refresh started by an earlier call already had its deadline, so it is only waited for without one
+        for isin, future in running.items():
+            if deadline is None:
+                future.result()
+            elif not future.done():
+                stale.add(isin)
+        if running:
+            logger.info(f"{len(running)} ISINs are refreshed by an earlier call; serving cached prices for {len(stale & set(running))}")
+        stale_isins = sorted(stale)
+        for isin in {block.isin for block in blocks} - stale:
+            cached_prices[isin] = price_store.read(isin, groups[isin]["date"].min(), end_date)
+
+    # Prices fetched this run may revise days a previous run valued already
+    refreshed = {block.isin for block in blocks} - set(stale_isins)
+    previous = None
+    if incremental:
+        holdings_state = holdings_state or HoldingsStateStore(cache_dir / DEFAULT_HOLDINGS_STATE_DIR.name)
+        fingerprints = _transaction_fingerprints(groups)
+        previous = holdings_state.load(cost_method)
+        # A previous run that started elsewhere or ran past end_date cannot be extended
+        if previous is not None and (previous.shares.index[0] != date_range[0] or previous.watermark > date_range[-1]):
+            previous = None
+
+    if previous is None:
+        recompute = reprice = set(groups)
+    else:
+        # Transactions after the watermark were not applied to the saved matrices yet
+        recompute = {
+            isin for isin, group in groups.items()
+            if previous.fingerprints.get(isin) != fingerprints[isin] or group["date"].max() > previous.watermark
+        }
+        reprice = recompute | refreshed | (set(previous.stale) & set(groups))
+
+    price_data_dict = {}
+    for isin, group in groups.items():
+        if isin in reprice:
+            price_data_dict[isin] = _valuation_prices(group, cached_prices[isin], end_date)
+        else:
+            # Unchanged before the watermark; the new days are filled forward below
+            new_prices = cached_prices[isin].loc[previous.watermark + ONE_DAY:]
+            price_data_dict[isin] = pd.concat([previous.prices[isin].loc[group["date"].min():], new_prices])
+
+    price_data = pd.DataFrame(price_data_dict).reindex(date_range).ffill()
+
+    if previous is None:
+        holdings, invested = _holdings_matrices(table, date_range, cost_method)
+    else:
+        kept = [isin for isin in groups if isin not in recompute]
+        holdings = [previous.shares[kept].reindex(date_range).ffill()]
+        invested = [previous.invested[kept].reindex(date_range).ffill()]
+        if recompute:
+            changed_holdings, changed_invested = _holdings_matrices(
+                table[table["isin"].isin(recompute)], date_range, cost_method
+            )
+            holdings.append(changed_holdings)
+            invested.append(changed_invested)
+        holdings = pd.concat(holdings, axis=1)[list(groups)].rename_axis(columns="isin")
+        invested = pd.concat(invested, axis=1)[list(groups)].rename_axis(columns=None)
+        logger.info(
+            f"Extended holdings from {previous.watermark.date()} to {date_range[-1].date()}: "
+            f"recomputed {len(recompute)} and repriced {len(reprice)} of {len(groups)} ISINs"
+        )
+
+    if incremental and (previous is None or reprice or previous.watermark != date_range[-1]):
+        write_in_background(holdings_state.save, cost_method, HoldingsState(
+            watermark=date_range[-1],
+            fingerprints=fingerprints,
+            shares=holdings,
+            invested=invested,
+            prices=price_data,
+            stale=stale_isins,
+        ))
+
+    shares_held = holdings[list(groups)].to_numpy()
+    invested_amount = invested[list(groups)].to_numpy()
+    valuation = shares_held * price_data[list(groups)].to_numpy()
+    return HoldingsCube.from_matrices(
+        date_range,
+        list(groups),
+        isin_names,
+        dtype=dtype,
+        stale_prices=stale_isins,
+        unrealized=valuation - invested_amount,
+        valuation=valuation,
+        invested=invested_amount,
     )
-    output.to_csv("holdings.csv")
 
+
+def export_holdings(cube: HoldingsCube, sink: Union[str, OutputSink, None] = None) -> pd.DataFrame:
+    """
+    Flat frame of ``cube``, handed to ``sink`` (default ``HOLDINGS_OUTPUT``,
+    or ``holdings.csv``) on the background writer.
+    """
+    output = cube.to_frame()
+    sink = output_sink(sink)
+    if not isinstance(sink, NullSink):
+        write_in_background(sink.write, output)
     return output
 
+
+def get_historical_holdings(
+    table: pd.DataFrame,
+    *args,
+    sink: Union[str, OutputSink, None] = None,
+    **kwargs,
+) -> pd.DataFrame:
+    """Flat frame of ``holdings_cube`` (same arguments), see ``HoldingsCube.to_frame``."""
+    return export_holdings(holdings_cube(table, *args, **kwargs), sink)
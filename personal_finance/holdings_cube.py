@@ -0,0 +1,128 @@
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Metrics of every ISIN on every day, in the order of the flat export
+METRICS = ("unrealized", "valuation", "invested")
+
+
+class HoldingsCube:
+    """
+    Daily holdings metrics as one dates x ISIN x metric array.
+
+    The axes are named by ``dims`` and labelled by ``dates``, ``isins`` and
+    ``METRICS``; ``names`` holds the display name of each ISIN. Values are
+    stored metric by metric, so ``metric`` and ``frame`` return each dates x
+    ISIN slab without copying, and the storage can be float32 to halve its
+    size. ``to_frame`` derives the flat frame with one column per ISIN and
+    metric that ``get_historical_holdings`` returns.
+    """
+
+    dims = ("date", "isin", "metric")
+
+    def __init__(
+        self,
+        dates: pd.DatetimeIndex,
+        isins: list[str],
+        names: dict[str, str],
+        storage: np.ndarray,
+        stale_prices: Optional[list[str]] = None,
+    ):
+        self.dates = dates
+        self.isins = list(isins)
+        self.names = names
+        # Shape (metric, date, isin); ``values`` is its dates x ISIN x metric view
+        self._storage = storage
+        self.stale_prices = stale_prices or []
+        self._frames: dict[str, pd.DataFrame] = {}
+
+    @classmethod
+    def from_matrices(
+        cls,
+        dates: pd.DatetimeIndex,
+        isins: list[str],
+        names: dict[str, str],
+        dtype=np.float64,
+        stale_prices: Optional[list[str]] = None,
+        **metrics: np.ndarray,
+    ) -> "HoldingsCube":
+        """Build a cube from one dates x ISIN array per metric in ``METRICS``."""
+        storage = np.empty((len(METRICS), len(dates), len(isins)), dtype=dtype)
+        for k, metric in enumerate(METRICS):
+            storage[k] = metrics[metric]
+        return cls(dates, isins, names, storage, stale_prices)
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._storage.transpose(1, 2, 0)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._storage.dtype
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        return self.values.shape
+
+    @property
+    def labels(self) -> list[str]:
+        """
+        Display name of each ISIN, in column order. A name shared by several
+        ISINs is suffixed with the ISIN so every label stays unique.
+        """
+        names = [self.names.get(isin, isin) for isin in self.isins]
+        counts = Counter(names)
+        return [name if counts[name] == 1 else f"{name} ({isin})" for name, isin in zip(names, self.isins)]
+
+    def metric(self, metric: str) -> np.ndarray:
+        """Dates x ISIN view of one metric."""
+        return self._storage[METRICS.index(metric)]
+
+    def frame(self, metric: str) -> pd.DataFrame:
+        """Zero-copy DataFrame of one metric, dates by ISIN."""
+        if metric not in self._frames:
+            self._frames[metric] = pd.DataFrame(
+                self.metric(metric),
+                index=self.dates.rename("date"),
+                columns=pd.Index(self.isins, name="isin"),
+                copy=False,
+            )
+        return self._frames[metric]
+
+    def total(self, metric: str) -> np.ndarray:
+        """Daily sum of one metric over all ISINs, accumulated in float64."""
+        return self.metric(metric).sum(axis=1, dtype=np.float64)
+
+    def on(self, date) -> pd.DataFrame:
+        """Metrics of every ISIN (rows, by display name) on the last day up to ``date``."""
+        position = self.dates.searchsorted(pd.Timestamp(date).normalize(), side="right") - 1
+        if position < 0:
+            return pd.DataFrame(columns=list(METRICS), dtype=self.dtype)
+        return pd.DataFrame(
+            self.values[position],
+            index=pd.Index(self.labels, name="name"),
+            columns=list(METRICS),
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Flat frame with a ``date`` column, the unrealized P&L of each ISIN
+        under its display name, ``<name>_valuation`` and ``<name>_invested``
+        columns, and the daily ``balance``, ``valuation`` and
+        ``transaction_number``.
+        """
+        labels = self.labels
+        columns = {"date": self.dates}
+        columns.update(zip(labels, self.metric("unrealized").T))
+        columns.update(zip((f"{label}_valuation" for label in labels), self.metric("valuation").T))
+        columns.update(zip((f"{label}_invested" for label in labels), self.metric("invested").T))
+        columns.update({
+            "balance": self.total("invested"),
+            "valuation": self.total("valuation"),
+            "transaction_number": np.arange(1, 1 + len(self.dates)),
+        })
+        output = pd.DataFrame(columns)
+        output.attrs["stale_prices"] = self.stale_prices
+        return output
@@ -0,0 +1,93 @@
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from personal_finance.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOLDINGS_STATE_DIR = Path(".cache") / "holdings"
+
+MATRICES = ("shares", "invested", "prices")
+
+
+@dataclass
+class HoldingsState:
+    """
+    Daily matrices (dates x ISIN) of a previous ``get_historical_holdings``
+    run, up to and including ``watermark``.
+
+    ``fingerprints`` identify the transactions each ISIN was computed from
+    and ``stale`` lists the ISINs that were valued with stale prices.
+    """
+
+    watermark: pd.Timestamp
+    fingerprints: dict[str, str]
+    shares: pd.DataFrame
+    invested: pd.DataFrame
+    prices: pd.DataFrame
+    stale: list[str] = field(default_factory=list)
+
+
+class HoldingsStateStore:
+    """
+    The last ``HoldingsState`` of each cost method, persisted between runs.
+
+    Every cost method has a directory with one Parquet file per matrix and a
+    ``state.json`` with the watermark, fingerprints and matrix file names.
+    Each save writes new matrix files and then swaps the JSON, so an
+    interrupted save leaves the previous state intact.
+    """
+
+    def __init__(self, root: Path = DEFAULT_HOLDINGS_STATE_DIR):
+        self.root = Path(root)
+
+    def load(self, cost_method: str) -> Optional[HoldingsState]:
+        directory = self.root / cost_method
+        path = directory / "state.json"
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r") as f:
+                stored = json.load(f)
+            matrices = {name: pd.read_parquet(directory / stored["files"][name]) for name in MATRICES}
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable holdings state in {directory}: {e}")
+            return None
+
+        watermark = pd.Timestamp(stored["watermark"])
+        return HoldingsState(
+            watermark=watermark,
+            fingerprints=stored["fingerprints"],
+            stale=stored.get("stale", []),
+            **matrices,
+        )
+
+    def save(self, cost_method: str, state: HoldingsState):
+        directory = self.root / cost_method
+        version = time.time_ns()
+        files = {name: f"{name}-{version}.parquet" for name in MATRICES}
+        for name in MATRICES:
+            matrix = getattr(state, name).rename_axis(index="date", columns=None)
+            atomic_write(directory / files[name], lambda tmp_name: matrix.to_parquet(tmp_name))
+
+        stored = {
+            "watermark": state.watermark.isoformat(),
+            "fingerprints": state.fingerprints,
+            "stale": state.stale,
+            "files": files,
+        }
+
+        def write(tmp_name):
+            with open(tmp_name, "w") as f:
+                json.dump(stored, f)
+        atomic_write(directory / "state.json", write)
+
+        for path in directory.glob("*.parquet"):
+            if path.name not in files.values():
+                path.unlink(missing_ok=True)
@@ -0,0 +1,54 @@
+import pandas as pd
+
+# Inclusive (first day, last day) pair of normalized timestamps
+Interval = tuple[pd.Timestamp, pd.Timestamp]
+
+ONE_DAY = pd.Timedelta(days=1)
+
+
+def merge_intervals(intervals, max_gap_days: int = 1) -> list[Interval]:
+    """
+    Sort and merge day intervals.
+
+    Two intervals are joined when the next one starts at most
+    ``max_gap_days`` after the previous one ends, so the default only joins
+    overlapping or adjacent intervals.
+    """
+    merged: list[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and (start - merged[-1][1]).days <= max_gap_days:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_intervals(intervals: list[Interval], removed: list[Interval]) -> list[Interval]:
+    """Days of ``intervals`` not in ``removed``; both must be merged and sorted."""
+    result: list[Interval] = []
+    j = 0
+    for start, end in intervals:
+        current = start
+        while j < len(removed) and removed[j][1] < current:
+            j += 1
+        k = j
+        while k < len(removed) and removed[k][0] <= end:
+            if removed[k][0] > current:
+                result.append((current, removed[k][0] - ONE_DAY))
+            current = max(current, removed[k][1] + ONE_DAY)
+            k += 1
+        if current <= end:
+            result.append((current, end))
+    return result
+
+
+def intervals_from_dates(dates) -> list[Interval]:
+    """Runs of consecutive days in ``dates``."""
+    dates = pd.DatetimeIndex(dates).normalize().unique().sort_values()
+    if len(dates) == 0:
+        return []
+    breaks = (dates[1:] - dates[:-1]).days > 1
+    starts = dates[1:][breaks].insert(0, dates[0])
+    ends = dates[:-1][breaks].append(dates[-1:])
+    return list(zip(starts, ends))
@@ -0,0 +1,96 @@
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional, Protocol, Union
+
+import pandas as pd
+
+from personal_finance.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Where computed holdings are written: "none", "csv" or "parquet"
+HOLDINGS_OUTPUT_ENV = "HOLDINGS_OUTPUT"
+DEFAULT_HOLDINGS_OUTPUT = "csv"
+
+
+class OutputSink(Protocol):
+    """Somewhere a computed frame is persisted; ``write`` runs on the background writer."""
+
+    name: str
+
+    def write(self, frame: pd.DataFrame):
+        ...
+
+
+class NullSink:
+    """Keep results in memory only."""
+
+    name = "none"
+
+    def write(self, frame: pd.DataFrame):
+        pass
+
+
+class CsvSink:
+    name = "csv"
+
+    def __init__(self, path: Path = Path("holdings.csv")):
+        self.path = Path(path)
+
+    def write(self, frame: pd.DataFrame):
+        atomic_write(self.path, lambda tmp_name: frame.to_csv(tmp_name))
+
+
+class ParquetSink:
+    name = "parquet"
+
+    def __init__(self, path: Path = Path("holdings.parquet")):
+        self.path = Path(path)
+
+    def write(self, frame: pd.DataFrame):
+        atomic_write(self.path, lambda tmp_name: frame.to_parquet(tmp_name, index=False))
+
+
+SINKS: dict[str, Callable[[], OutputSink]] = {
+    "none": NullSink,
+    "csv": CsvSink,
+    "parquet": ParquetSink,
+}
+
+
+def output_sink(sink: Union[str, OutputSink, None] = None) -> OutputSink:
+    """
+    A sink from its name or itself; defaults to the ``HOLDINGS_OUTPUT``
+    environment variable, or CSV.
+    """
+    if sink is None:
+        sink = os.environ.get(HOLDINGS_OUTPUT_ENV, DEFAULT_HOLDINGS_OUTPUT).strip() or DEFAULT_HOLDINGS_OUTPUT
+    if isinstance(sink, str):
+        if sink not in SINKS:
+            raise ValueError(f"Unknown output sink '{sink}', expected one of {sorted(SINKS)}")
+        sink = SINKS[sink]()
+    return sink
+
+
+# Writes run here one at a time, in the order they were submitted
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="output-writer")
+
+
+def write_in_background(write: Callable, *args) -> Future:
+    """
+    Run ``write(*args)`` on the background writer. Failures are logged
+    rather than raised, as nobody waits for the result on the request path.
+    """
+    def run():
+        try:
+            write(*args)
+        except Exception as e:
+            logger.warning(f"Background write by {getattr(write, '__qualname__', write)} failed: {e}")
+    return _writer.submit(run)
+
+
+def flush_writes(timeout: Optional[float] = None):
+    """Block until every write submitted so far has finished."""
+    _writer.submit(lambda: None).result(timeout=timeout)
@@ -0,0 +1,309 @@
+import json
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from personal_finance.files import atomic_write
+from personal_finance.intervals import Interval, intervals_from_dates, merge_intervals, subtract_intervals
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRICE_DIR = Path(".cache") / "prices"
+LEGACY_CACHE_PATH = Path("price_cache.csv")
+
+# Appended segments an ISIN may accumulate before it is compacted
+MAX_SEGMENTS = 8
+
+
+@dataclass(frozen=True)
+class FreshnessPolicy:
+    """
+    When cached prices are fetched again.
+
+    Days older than ``settle_days`` are settled: once fetched after
+    settling they are never requested again. Days fetched while still
+    recent (today's moving close, late corrections) are refetched once
+    ``recent_ttl`` has passed. Known-missing intervals are retried after
+    ``retry_after``, doubling with every failed attempt up to
+    ``max_retry_after``.
+    """
+
+    settle_days: int = 3
+    recent_ttl: pd.Timedelta = pd.Timedelta(hours=1)
+    retry_after: pd.Timedelta = pd.Timedelta(days=1)
+    max_retry_after: pd.Timedelta = pd.Timedelta(days=32)
+
+    def settled_before(self, now: pd.Timestamp) -> pd.Timestamp:
+        return now.normalize() - pd.Timedelta(days=self.settle_days)
+
+    def retry_delay(self, attempts: int) -> pd.Timedelta:
+        return min(self.retry_after * 2 ** max(attempts - 1, 0), self.max_retry_after)
+
+
+def _empty_prices() -> pd.Series:
+    return pd.Series(dtype=float, index=pd.DatetimeIndex([], name="date"), name="close")
+
+
+class PriceStore:
+    """
+    Daily close prices in GBP, partitioned by ISIN.
+
+    Each ISIN has its own directory with a compacted ``prices.parquet``
+    and any number of small append-only ``segment-*.parquet`` files
+    written by ``append``. Reads only touch the directory of the ISIN they
+    ask for, and rows appended later win over earlier ones for the same
+    date. ``compact`` folds the segments back into one sorted file with an
+    atomic rename.
+
+    Alongside the prices each ISIN keeps a ``coverage.json`` of merged day
+    intervals that have already been requested from a provider, and of
+    the known-missing intervals among them for which nothing came back.
+    Working out what still has to be fetched is then interval arithmetic
+    over a handful of intervals rather than a scan of every cached day.
+
+    The coverage also remembers when days that had not settled yet were
+    fetched, and how often known-missing intervals have been tried, so
+    that the ``FreshnessPolicy`` can expire them.
+    """
+
+    def __init__(
+        self,
+        root: Path = DEFAULT_PRICE_DIR,
+        max_segments: int = MAX_SEGMENTS,
+        freshness: Optional[FreshnessPolicy] = None,
+    ):
+        self.root = Path(root)
+        self.max_segments = max_segments
+        self.freshness = freshness or FreshnessPolicy()
+        self._series: dict[str, pd.Series] = {}
+        self._coverage: dict[str, dict[str, list]] = {}
+        # Prices may be refreshed in the background while a later run plans its fetches
+        self._lock = threading.RLock()
+
+    def _isin_dir(self, isin: str) -> Path:
+        return self.root / re.sub(r"[^0-9A-Za-z_.-]", "_", isin)
+
+    def _segments(self, isin: str) -> list[Path]:
+        directory = self._isin_dir(isin)
+        if not directory.exists():
+            return []
+        return sorted(directory.glob("segment-*.parquet"))
+
+    def isins(self) -> list[str]:
+        if not self.root.exists():
+            return []
+        return sorted(path.name for path in self.root.iterdir() if path.is_dir())
+
+    def _load(self, isin: str) -> pd.Series:
+        if isin not in self._series:
+            paths = [self._isin_dir(isin) / "prices.parquet"] + self._segments(isin)
+            frames = [pd.read_parquet(path, memory_map=True) for path in paths if path.exists()]
+            if frames:
+                df = pd.concat(frames, ignore_index=True)
+                series = df.set_index("date")["close"].astype(float)
+                series = series[~series.index.duplicated(keep="last")].sort_index()
+            else:
+                series = _empty_prices()
+            self._series[isin] = series
+        return self._series[isin]
+
+    def _coverage_path(self, isin: str) -> Path:
+        return self._isin_dir(isin) / "coverage.json"
+
+    def _load_coverage(self, isin: str) -> dict[str, list]:
+        if isin not in self._coverage:
+            coverage = {"covered": [], "missing": [], "fetched": []}
+            path = self._coverage_path(isin)
+            if path.exists():
+                with open(path, "r") as f:
+                    stored = json.load(f)
+                coverage["covered"] = [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in stored["covered"]]
+                for entry in stored.get("missing", []):
+                    # Entries written before retries were tracked are retried straight away
+                    start, end, attempts, last_attempt = (entry + [1, None])[:4]
+                    coverage["missing"].append((
+                        pd.Timestamp(start), pd.Timestamp(end), attempts,
+                        pd.Timestamp(last_attempt) if last_attempt else None,
+                    ))
+                coverage["fetched"] = [
+                    (pd.Timestamp(start), pd.Timestamp(end), pd.Timestamp(fetched_at))
+                    for start, end, fetched_at in stored.get("fetched", [])
+                ]
+            self._coverage[isin] = coverage
+        return self._coverage[isin]
+
+    def coverage(self, isin: str) -> list[Interval]:
+        """Merged intervals already requested for ``isin``, fetched or not."""
+        return list(self._load_coverage(isin)["covered"])
+
+    def missing(self, isin: str) -> list[Interval]:
+        """Requested intervals for which no price could be fetched."""
+        return merge_intervals((start, end) for start, end, _, _ in self._load_coverage(isin)["missing"])
+
+    def expired(self, isin: str, now: Optional[pd.Timestamp] = None) -> list[Interval]:
+        """Covered intervals the freshness policy wants fetched again."""
+        now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+        coverage = self._load_coverage(isin)
+        stale = [
+            (start, end)
+            for start, end, fetched_at in coverage["fetched"]
+            if now - fetched_at > self.freshness.recent_ttl
+        ]
+        retry = [
+            (start, end)
+            for start, end, attempts, last_attempt in coverage["missing"]
+            if last_attempt is None or now - last_attempt >= self.freshness.retry_delay(attempts)
+        ]
+        return merge_intervals(stale + retry)
+
+    def gaps(self, isin: str, required: list[Interval], now: Optional[pd.Timestamp] = None) -> list[Interval]:
+        """Parts of ``required`` (merged and sorted) never requested or expired since."""
+        with self._lock:
+            covered = subtract_intervals(self._load_coverage(isin)["covered"], self.expired(isin, now))
+            return subtract_intervals(required, covered)
+
+    def record_coverage(
+        self,
+        isin: str,
+        requested: list[Interval],
+        missing: list[Interval] = (),
+        now: Optional[pd.Timestamp] = None,
+    ):
+        """Mark ``requested`` as covered, ``missing`` being the parts nothing came back for."""
+        with self._lock:
+            now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+            requested = merge_intervals(requested)
+            coverage = self._load_coverage(isin)
+            coverage["covered"] = merge_intervals(coverage["covered"] + requested)
+
+            def outside_requested(entries):
+                # Older entries keep their metadata on the days this request did not cover
+                return [
+                    (piece_start, piece_end, *metadata)
+                    for start, end, *metadata in entries
+                    for piece_start, piece_end in subtract_intervals([(start, end)], requested)
+                ]
+
+            new_missing = []
+            for start, end in merge_intervals(missing):
+                attempts = max(
+                    (entry[2] for entry in coverage["missing"] if entry[0] <= end and entry[1] >= start),
+                    default=0,
+                )
+                new_missing.append((start, end, attempts + 1, now))
+            coverage["missing"] = sorted(outside_requested(coverage["missing"]) + new_missing, key=lambda e: e[0])
+
+            # Only days that had not settled when they were fetched can still change
+            settled_before = self.freshness.settled_before(now)
+            new_fetched = [(max(start, settled_before), end, now) for start, end in requested if end >= settled_before]
+            coverage["fetched"] = sorted(outside_requested(coverage["fetched"]) + new_fetched, key=lambda e: e[0])
+
+            stored = {
+                "covered": [[start.date().isoformat(), end.date().isoformat()] for start, end in coverage["covered"]],
+                "missing": [
+                    [start.date().isoformat(), end.date().isoformat(), attempts,
+                     last_attempt.isoformat() if last_attempt is not None else None]
+                    for start, end, attempts, last_attempt in coverage["missing"]
+                ],
+                "fetched": [
+                    [start.date().isoformat(), end.date().isoformat(), fetched_at.isoformat()]
+                    for start, end, fetched_at in coverage["fetched"]
+                ],
+            }
+
+            def write(tmp_name):
+                with open(tmp_name, "w") as f:
+                    json.dump(stored, f)
+            atomic_write(self._coverage_path(isin), write)
+
+    def read(self, isin: str, start_date=None, end_date=None) -> pd.Series:
+        """Cached closes of one ISIN between ``start_date`` and ``end_date`` inclusive."""
+        with self._lock:
+            series = self._load(isin)
+            if start_date is None and end_date is None:
+                return series.copy()
+            return series.loc[start_date:end_date].copy()
+
+    def append(self, isin: str, prices: pd.Series):
+        """Persist newly fetched closes as a new segment."""
+        with self._lock:
+            if prices.empty:
+                return
+            df = pd.DataFrame({
+                "date": pd.DatetimeIndex(prices.index).normalize(),
+                "close": prices.to_numpy(dtype=float),
+            })
+            directory = self._isin_dir(isin)
+            path = directory / f"segment-{time.time_ns()}.parquet"
+            atomic_write(path, lambda tmp_name: df.to_parquet(tmp_name, index=False))
+
+            if isin in self._series:
+                merged = pd.concat([self._series[isin], df.set_index("date")["close"]])
+                self._series[isin] = merged[~merged.index.duplicated(keep="last")].sort_index()
+
+            if len(self._segments(isin)) > self.max_segments:
+                self.compact(isin)
+
+    def compact(self, isin: str):
+        """Fold the segments of ``isin`` into its sorted base file."""
+        with self._lock:
+            segments = self._segments(isin)
+            if not segments:
+                return
+            self._series.pop(isin, None)
+            series = self._load(isin)
+            df = series.rename("close").rename_axis("date").reset_index()
+            atomic_write(
+                self._isin_dir(isin) / "prices.parquet",
+                lambda tmp_name: df.to_parquet(tmp_name, index=False),
+            )
+            for path in segments:
+                path.unlink(missing_ok=True)
+            logger.debug(f"Compacted {len(segments)} price segments for {isin}")
+
+    def import_csv(self, path: Path = LEGACY_CACHE_PATH):
+        """One-off migration of the old single-file ``price_cache.csv``."""
+        cache_df = pd.read_csv(path, parse_dates=["date"])
+        for isin, group in cache_df.groupby("isin"):
+            isin = str(isin)
+            # The CSV held one row per requested day, NaN where nothing was fetched
+            self.append(isin, group.dropna(subset=["close"]).set_index("date")["close"])
+            self.compact(isin)
+            self.record_coverage(
+                isin,
+                intervals_from_dates(group["date"]),
+                missing=intervals_from_dates(group.loc[group["close"].isna(), "date"]),
+            )
+        logger.info(f"Imported {len(cache_df)} cached prices from {path}")
+
+
+_shared_stores: dict[Path, PriceStore] = {}
+_shared_lock = threading.Lock()
+
+
+def shared_price_store(root: Path) -> PriceStore:
+    """
+    The one store of this process for ``root``. Runs and background
+    refreshes must share it so that they also share its lock and the
+    coverage it has in memory.
+    """
+    key = Path(root).resolve()
+    with _shared_lock:
+        if key not in _shared_stores:
+            _shared_stores[key] = PriceStore(root)
+        return _shared_stores[key]
+
+
+def default_price_store() -> PriceStore:
+    """The store under ``.cache/prices``, seeded from a legacy ``price_cache.csv`` if present."""
+    store = shared_price_store(DEFAULT_PRICE_DIR)
+    with store._lock:
+        if not store.root.exists() and LEGACY_CACHE_PATH.exists():
+            store.import_csv(LEGACY_CACHE_PATH)
+    return store
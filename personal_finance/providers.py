@@ -0,0 +1,501 @@
+import bisect
+import logging
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from functools import cache
+from pathlib import Path
+from typing import Callable, Optional, Protocol, Sequence, Union
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from dotenv import load_dotenv
+
+from personal_finance.fx import fx_pair
+from personal_finance.intervals import merge_intervals
+from personal_finance.price_store import FreshnessPolicy
+from personal_finance.rate_limit import RateLimiter
+from personal_finance.symbols import SymbolCache, default_symbol_cache, http_session
+
+logger = logging.getLogger(__name__)
+
+# A fetched close series together with the currency it is quoted in
+Quote = tuple[pd.Series, Optional[str]]
+
+# Yahoo blocks closer than this share one download window
+YF_BATCH_GAP_DAYS = 31
+# Tickers per multi-ticker Yahoo download
+YF_BATCH_SIZE = 50
+
+# Comma-separated provider names used when none are passed explicitly
+PRICE_PROVIDERS_ENV = "PRICE_PROVIDERS"
+DEFAULT_PROVIDERS = ("yahoo", "eodhd")
+
+DEFAULT_OFFLINE_DIR = Path("data") / "offline"
+
+# Price, FX and holdings caches of the default chain; other chains get their own below it
+DEFAULT_CACHE_DIR = Path(".cache")
+
+# Seconds any single provider HTTP request may take before it is abandoned
+REQUEST_TIMEOUT = 10
+
+
+def no_quote() -> Quote:
+    return pd.Series(dtype=float), None
+
+
+@dataclass(frozen=True)
+class PriceRequest:
+    isin: str
+    yf_name: Optional[str]
+    start: pd.Timestamp
+    end: pd.Timestamp
+
+
+class PriceProvider(Protocol):
+    """
+    A source of daily close prices and FX rates.
+
+    ``fetch_prices`` answers a batch of requests in order, with an empty
+    quote for each request it has nothing for, and may use ``executor`` to
+    run its own requests concurrently. ``fetch_fx`` returns the daily
+    ``{currency}GBP`` rate, or an empty series.
+    """
+
+    name: str
+
+    def fetch_prices(self, requests: list[PriceRequest], executor: ThreadPoolExecutor) -> list[Quote]:
+        ...
+
+    def fetch_fx(self, currency: str, start_date: datetime, end_date: datetime) -> pd.Series:
+        ...
+
+
+def _yf_currency(yf_name: str, symbols: Optional[SymbolCache] = None) -> str:
+    symbols = symbols or default_symbol_cache()
+    currency = symbols.get("yf_currency", yf_name)
+    if currency is None:
+        currency = yf.Ticker(yf_name).fast_info.get("currency", "GBP")
+        symbols.put("yf_currency", yf_name, currency)
+    return currency
+
+
+def _fetch_from_yf(yf_name: str, start_date: datetime, end_date: datetime) -> Quote:
+    try:
+        t = yf.Ticker(yf_name)
+        # Add 1 day to end_date to ensure inclusive fetching
+        data = t.history(start=start_date, end=end_date + pd.Timedelta(days=1), timeout=REQUEST_TIMEOUT)
+        if data.empty:
+            return no_quote()
+
+        data.index = data.index.tz_localize(None).normalize()
+        return data["Close"], _yf_currency(yf_name)
+    except Exception as e:
+        logger.warning(f"YF fetch failed for {yf_name}: {e}")
+        return no_quote()
+
+
+def _download_yf(yf_names: list[str], start_date: datetime, end_date: datetime) -> dict[str, pd.Series]:
+    """Close series of several Yahoo tickers from a single ``yf.download`` call."""
+    data = yf.download(
+        yf_names,
+        start=start_date,
+        end=end_date + pd.Timedelta(days=1),
+        group_by="ticker",
+        auto_adjust=True,
+        progress=False,
+        threads=False,
+        timeout=REQUEST_TIMEOUT,
+    )
+    if data.empty:
+        return {}
+    data.index = pd.DatetimeIndex(data.index).tz_localize(None).normalize()
+
+    closes = {}
+    for yf_name in yf_names:
+        if isinstance(data.columns, pd.MultiIndex):
+            if yf_name not in data.columns.get_level_values(0):
+                continue
+            series = data[yf_name]["Close"]
+        else:
+            series = data["Close"]
+        series = series.dropna()
+        if not series.empty:
+            closes[yf_name] = series
+    return closes
+
+
+def _download_fx(pair: str, start_date: datetime, end_date: datetime) -> pd.Series:
+    fx_data = yf.download(
+        pair, start=start_date, end=end_date + pd.Timedelta(days=1), progress=False, timeout=REQUEST_TIMEOUT
+    )
+    if fx_data.empty:
+        return pd.Series(dtype=float)
+    fx_series = fx_data["Adj Close"] if "Adj Close" in fx_data.columns else fx_data["Close"]
+    if isinstance(fx_series, pd.DataFrame):
+        fx_series = fx_series.iloc[:, 0]
+    fx_series.index = fx_series.index.tz_localize(None).normalize()
+    return fx_series.dropna()
+
+
+class YahooProvider:
+    """
+    Prices from Yahoo Finance for requests that have a ``yf_name``.
+
+    With ``batch`` the requests are grouped into download windows (requests
+    less than ``YF_BATCH_GAP_DAYS`` apart share one) and each window is
+    fetched with one ``yf.download`` call for up to ``YF_BATCH_SIZE``
+    tickers; otherwise every request is its own ``history`` call.
+    """
+
+    name = "yahoo"
+
+    def __init__(self, rate_limit: Optional[RateLimiter] = None, batch: bool = True):
+        self.rate_limit = rate_limit or RateLimiter(max_concurrent=4, per_second=5)
+        self.batch = batch
+
+    def _currency(self, yf_name: str) -> Optional[str]:
+        try:
+            with self.rate_limit:
+                return _yf_currency(yf_name)
+        except Exception as e:
+            logger.warning(f"YF currency lookup failed for {yf_name}: {e}")
+            return None
+
+    def fetch_prices(self, requests: list[PriceRequest], executor: ThreadPoolExecutor) -> list[Quote]:
+        quotes = [no_quote()] * len(requests)
+        positions = [i for i, request in enumerate(requests) if request.yf_name]
+        if not positions:
+            return quotes
+
+        if self.batch:
+            fetched = self._fetch_batched([requests[i] for i in positions], executor)
+        else:
+            def fetch(request):
+                with self.rate_limit:
+                    return _fetch_from_yf(request.yf_name, request.start, request.end)
+            fetched = executor.map(fetch, [requests[i] for i in positions])
+
+        for i, quote in zip(positions, fetched):
+            quotes[i] = quote
+        return quotes
+
+    def _fetch_batched(self, requests: list[PriceRequest], executor: ThreadPoolExecutor) -> list[Quote]:
+        windows = merge_intervals([(request.start, request.end) for request in requests], max_gap_days=YF_BATCH_GAP_DAYS)
+        window_starts = [start for start, _ in windows]
+        request_windows = [bisect.bisect_right(window_starts, request.start) - 1 for request in requests]
+
+        downloads = []
+        for w, (window_start, window_end) in enumerate(windows):
+            yf_names = sorted({request.yf_name for request, rw in zip(requests, request_windows) if rw == w})
+            for i in range(0, len(yf_names), YF_BATCH_SIZE):
+                downloads.append((w, yf_names[i:i + YF_BATCH_SIZE], window_start, window_end))
+
+        def download(batch):
+            _, yf_names, window_start, window_end = batch
+            try:
+                with self.rate_limit:
+                    return _download_yf(yf_names, window_start, window_end)
+            except Exception as e:
+                logger.warning(f"YF batch download failed for {len(yf_names)} tickers: {e}")
+                return {}
+
+        closes: dict[tuple[int, str], pd.Series] = {}
+        for (w, _, _, _), downloaded in zip(downloads, executor.map(download, downloads)):
+            closes.update({(w, yf_name): series for yf_name, series in downloaded.items()})
+        logger.info(f"Fetched {len(requests)} Yahoo price blocks with {len(downloads)} batched downloads")
+
+        yf_names = sorted({yf_name for _, yf_name in closes})
+        currencies = dict(zip(yf_names, executor.map(self._currency, yf_names)))
+
+        quotes = []
+        for request, w in zip(requests, request_windows):
+            series = closes.get((w, request.yf_name))
+            if series is not None:
+                series = series.loc[request.start:request.end]
+            if series is None or series.empty or currencies[request.yf_name] is None:
+                quotes.append(no_quote())
+            else:
+                quotes.append((series, currencies[request.yf_name]))
+        return quotes
+
+    def fetch_fx(self, currency: str, start_date: datetime, end_date: datetime) -> pd.Series:
+        with self.rate_limit:
+            return _download_fx(fx_pair(currency), start_date, end_date)
+
+
+@cache
+def _eodhd_api_key() -> Optional[str]:
+    load_dotenv()
+    return os.environ.get("EODHD_API_KEY")
+
+
+def _resolve_eodhd(
+    isin: str,
+    api_key: str,
+    symbols: SymbolCache,
+    now: Optional[pd.Timestamp] = None,
+) -> Optional[dict]:
+    """
+    EODHD ticker, exchange and currency of an ISIN, searched once and then cached.
+
+    A search without matches is cached with its time and attempt count and
+    searched again on the backoff of ``FreshnessPolicy.retry_delay``.
+    """
+    resolved = symbols.get("eodhd", isin)
+    if resolved and "ticker" in resolved:
+        return resolved
+
+    now = pd.Timestamp.now() if now is None else now
+    # Empty entries from before the retry existed are searched again straight away
+    attempts = (resolved or {}).get("attempts", 0)
+    if resolved and now - pd.Timestamp(resolved["searched"]) < FreshnessPolicy().retry_delay(attempts):
+        return None
+
+    search_url = f"https://eodhd.com/api/search/{isin}?api_token={api_key}&fmt=json"
+    search_resp = http_session().get(search_url, timeout=REQUEST_TIMEOUT)
+    search_resp.raise_for_status()
+    search_data = search_resp.json()
+    if search_data:
+        resolved = {
+            "ticker": search_data[0]["Code"],
+            "exchange": search_data[0]["Exchange"],
+            "currency": search_data[0].get("Currency", "GBP"),
+        }
+    else:
+        resolved = {"searched": now.isoformat(), "attempts": attempts + 1}
+    symbols.put("eodhd", isin, resolved)
+    return resolved if "ticker" in resolved else None
+
+
+def _fetch_from_eodhd(
+    isin: str,
+    start_date: datetime,
+    end_date: datetime,
+    symbols: Optional[SymbolCache] = None,
+) -> Quote:
+    api_key = _eodhd_api_key()
+    if not api_key:
+        return no_quote()
+
+    try:
+        resolved = _resolve_eodhd(isin, api_key, symbols or default_symbol_cache())
+        if resolved is None:
+            return no_quote()
+
+        eod_ticker = resolved["ticker"] + "." + resolved["exchange"]
+        currency = resolved["currency"]
+
+        eod_url = f"https://eodhd.com/api/eod/{eod_ticker}?from={start_date.strftime('%Y-%m-%d')}&to={end_date.strftime('%Y-%m-%d')}&api_token={api_key}&fmt=json"
+        eod_resp = http_session().get(eod_url, timeout=REQUEST_TIMEOUT)
+        eod_resp.raise_for_status()
+        eod_data = eod_resp.json()
+
+        if not eod_data:
+            return no_quote()
+
+        df = pd.DataFrame(eod_data)
+        df["date"] = pd.to_datetime(df["date"])
+        df.set_index("date", inplace=True)
+        series = df["adjusted_close"] if "adjusted_close" in df.columns else df["close"]
+
+        return series, currency
+    except Exception as e:
+        logger.warning(f"EODHD fetch failed for ISIN {isin}: {e}")
+        return no_quote()
+
+
+class EodhdProvider:
+    """Prices from EODHD by ISIN, one request per block. Needs ``EODHD_API_KEY``."""
+
+    name = "eodhd"
+
+    def __init__(self, rate_limit: Optional[RateLimiter] = None):
+        self.rate_limit = rate_limit or RateLimiter(max_concurrent=4, per_second=10)
+
+    def fetch_prices(self, requests: list[PriceRequest], executor: ThreadPoolExecutor) -> list[Quote]:
+        def fetch(request):
+            with self.rate_limit:
+                return _fetch_from_eodhd(request.isin, request.start, request.end)
+        return list(executor.map(fetch, requests))
+
+    def fetch_fx(self, currency: str, start_date: datetime, end_date: datetime) -> pd.Series:
+        return pd.Series(dtype=float)
+
+
+# Business days of every synthetic series are counted from this date, so a
+# given day has the same value whatever window it is requested in
+SYNTHETIC_EPOCH = pd.Timestamp("2000-01-03")
+
+SYNTHETIC_FX_BASE = {"USD": 0.79, "EUR": 0.85, "CHF": 0.88, "JPY": 0.0053}
+
+
+def synthetic_series(key: str, end_date, base: float, volatility: float) -> pd.Series:
+    """Deterministic geometric random walk over business days, seeded by ``key``."""
+    days = np.arange(SYNTHETIC_EPOCH.to_datetime64(), pd.Timestamp(end_date).to_datetime64() + 1, dtype="datetime64[D]")
+    dates = pd.DatetimeIndex(days[np.is_busday(days)]).as_unit("ns")
+    rng = np.random.default_rng(zlib.crc32(key.encode()))
+    values = base * np.exp(np.cumsum(rng.normal(0.0, volatility, len(dates))))
+    return pd.Series(values, index=dates)
+
+
+def _synthetic_horizon(end_date: pd.Timestamp) -> pd.Timestamp:
+    # Generate to the end of the next year so later windows of the same run reuse the series
+    return pd.Timestamp(year=end_date.year + 1, month=12, day=31)
+
+
+class OfflineProvider:
+    """
+    Prices and FX rates from local files, for tests, benchmarks and
+    air-gapped machines.
+
+    Prices are read from ``<root>/prices/<isin>.csv`` (``date``, ``close``
+    and optionally ``currency``) and rates from ``<root>/fx/<currency>.csv``
+    (``date``, ``rate``). With ``synthesize`` an ISIN or currency without a
+    file gets a deterministic synthetic series instead, quoted in GBP
+    unless ``currencies`` says otherwise. ``write_files`` exports synthetic
+    series in the same layout.
+    """
+
+    name = "offline"
+
+    def __init__(
+        self,
+        root: Path = DEFAULT_OFFLINE_DIR,
+        synthesize: bool = True,
+        currencies: Optional[dict[str, str]] = None,
+    ):
+        self.root = Path(root)
+        self.synthesize = synthesize
+        self.currencies = currencies or {}
+        self._prices: dict[str, Quote] = {}
+        self._rates: dict[str, pd.Series] = {}
+        # Last day generated for synthetic series, which are extended on demand
+        self._synthetic_until: dict[str, pd.Timestamp] = {}
+
+    @staticmethod
+    def _synthetic_price(isin: str, end_date) -> pd.Series:
+        base = 10.0 + zlib.crc32(isin.encode()) % 190
+        return synthetic_series(isin, end_date, base, volatility=0.01)
+
+    @staticmethod
+    def _synthetic_rate(currency: str, end_date) -> pd.Series:
+        return synthetic_series(fx_pair(currency), end_date, SYNTHETIC_FX_BASE.get(currency, 1.0), volatility=0.004)
+
+    def _price(self, isin: str, end_date: pd.Timestamp) -> Quote:
+        if isin not in self._prices or self._synthetic_until.get(isin, end_date) < end_date:
+            path = self.root / "prices" / f"{isin}.csv"
+            if path.exists():
+                df = pd.read_csv(path, parse_dates=["date"])
+                currency = df["currency"].iloc[0] if "currency" in df.columns and len(df) else "GBP"
+                self._prices[isin] = df.set_index("date")["close"].sort_index(), currency
+            elif self.synthesize:
+                until = _synthetic_horizon(end_date)
+                self._prices[isin] = self._synthetic_price(isin, until), self.currencies.get(isin, "GBP")
+                self._synthetic_until[isin] = until
+            else:
+                self._prices[isin] = no_quote()
+        return self._prices[isin]
+
+    def fetch_prices(self, requests: list[PriceRequest], executor: ThreadPoolExecutor) -> list[Quote]:
+        quotes = []
+        for request in requests:
+            series, currency = self._price(request.isin, request.end)
+            series = series.loc[request.start:request.end]
+            quotes.append((series, currency) if not series.empty else no_quote())
+        return quotes
+
+    def fetch_fx(self, currency: str, start_date: datetime, end_date: datetime) -> pd.Series:
+        end_date = pd.Timestamp(end_date)
+        key = fx_pair(currency)
+        if key not in self._rates or self._synthetic_until.get(key, end_date) < end_date:
+            path = self.root / "fx" / f"{currency}.csv"
+            if path.exists():
+                self._rates[key] = pd.read_csv(path, parse_dates=["date"]).set_index("date")["rate"].sort_index()
+            elif self.synthesize:
+                until = _synthetic_horizon(end_date)
+                self._rates[key] = self._synthetic_rate(currency, until)
+                self._synthetic_until[key] = until
+            else:
+                return pd.Series(dtype=float)
+        return self._rates[key].loc[start_date:end_date]
+
+    def write_files(self, isins: Sequence[str], end_date, fx_currencies: Sequence[str] = ()):
+        """Export synthetic price (and FX) series up to ``end_date`` as offline files."""
+        (self.root / "prices").mkdir(parents=True, exist_ok=True)
+        for isin in isins:
+            series = self._synthetic_price(isin, end_date)
+            series.rename("close").rename_axis("date").reset_index().assign(
+                currency=self.currencies.get(isin, "GBP")
+            ).to_csv(self.root / "prices" / f"{isin}.csv", index=False)
+        if fx_currencies:
+            (self.root / "fx").mkdir(parents=True, exist_ok=True)
+        for currency in fx_currencies:
+            self._synthetic_rate(currency, end_date).rename("rate").rename_axis("date").reset_index().to_csv(
+                self.root / "fx" / f"{currency}.csv", index=False
+            )
+
+
+PROVIDERS: dict[str, Callable[[], PriceProvider]] = {
+    "yahoo": YahooProvider,
+    "eodhd": EodhdProvider,
+    "offline": OfflineProvider,
+}
+
+
+def register_provider(name: str, factory: Callable[[], PriceProvider]):
+    """Make a provider available by name, e.g. in ``PRICE_PROVIDERS``."""
+    PROVIDERS[name] = factory
+
+
+def provider_chain(providers: Optional[Sequence[Union[str, PriceProvider]]] = None) -> list[PriceProvider]:
+    """
+    Providers in priority order, from names and/or instances.
+
+    Defaults to the comma-separated names in the ``PRICE_PROVIDERS``
+    environment variable, or Yahoo then EODHD.
+    """
+    if providers is None:
+        names = os.environ.get(PRICE_PROVIDERS_ENV)
+        providers = [name.strip() for name in names.split(",") if name.strip()] if names else DEFAULT_PROVIDERS
+    chain = []
+    for provider in providers:
+        if isinstance(provider, str):
+            if provider not in PROVIDERS:
+                raise ValueError(f"Unknown price provider '{provider}', expected one of {sorted(PROVIDERS)}")
+            provider = PROVIDERS[provider]()
+        chain.append(provider)
+    return chain
+
+
+def chain_cache_dir(chain: Sequence[PriceProvider], root: Path = DEFAULT_CACHE_DIR) -> Path:
+    """
+    Directory of the caches filled by ``chain``: ``root`` itself for the
+    default Yahoo then EODHD chain, else ``root/providers/<names>``, so that
+    e.g. the offline provider's synthetic closes never reach a real run.
+    """
+    names = tuple(provider.name for provider in chain)
+    if names == DEFAULT_PROVIDERS:
+        return Path(root)
+    return Path(root) / "providers" / "+".join(names)
+
+
+def fetch_from_chain(
+    chain: list[PriceProvider],
+    requests: list[PriceRequest],
+    executor: ThreadPoolExecutor,
+) -> list[Quote]:
+    """Ask each provider in turn for the requests the previous ones returned nothing for."""
+    quotes = [no_quote()] * len(requests)
+    pending = list(range(len(requests)))
+    for provider in chain:
+        if not pending:
+            break
+        fetched = provider.fetch_prices([requests[i] for i in pending], executor)
+        for i, quote in zip(pending, fetched):
+            quotes[i] = quote
+        pending = [i for i in pending if quotes[i][0].empty]
+    return quotes
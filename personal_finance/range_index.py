@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+WINDOW_STATISTICS = ["first", "last", "net_change", "mean", "min", "max"]
+
+
+class RangeQueryIndex:
+    """
+    Constant-time window statistics over the columns of a date-indexed frame.
+
+    Prefix sums (and prefix counts of non-NaN values) answer window means,
+    and sparse tables of overlapping power-of-two blocks answer window
+    minima and maxima with two lookups. Building costs O(n log n) per
+    column; every query afterwards is O(1) per column regardless of the
+    window length.
+    """
+
+    def __init__(self, frame: pd.DataFrame):
+        self.dates = pd.DatetimeIndex(frame.index)
+        self.columns = list(frame.columns)
+        values = frame.to_numpy(dtype=np.float64)
+        self.values = values
+
+        n_rows, n_columns = values.shape
+        valid = ~np.isnan(values)
+        self._sums = np.zeros((n_rows + 1, n_columns))
+        np.cumsum(np.where(valid, values, 0.0), axis=0, out=self._sums[1:])
+        self._counts = np.zeros((n_rows + 1, n_columns), dtype=np.int64)
+        np.cumsum(valid, axis=0, out=self._counts[1:])
+
+        # Level k holds the min/max of each block of 2**k rows starting at row i
+        self._mins = [values]
+        self._maxs = [values]
+        width = 1
+        while 2 * width <= n_rows:
+            previous_min, previous_max = self._mins[-1], self._maxs[-1]
+            self._mins.append(np.fmin(previous_min[:-width], previous_min[width:]))
+            self._maxs.append(np.fmax(previous_max[:-width], previous_max[width:]))
+            width *= 2
+
+    def _bounds(self, start_date, end_date) -> tuple[int, int]:
+        """Row positions [i, j) covering the dates between start_date and end_date inclusive."""
+        i = 0 if start_date is None else int(self.dates.searchsorted(pd.Timestamp(start_date), side='left'))
+        j = len(self.dates) if end_date is None else int(self.dates.searchsorted(pd.Timestamp(end_date), side='right'))
+        return i, max(i, j)
+
+    def _series(self, values: np.ndarray, name: str) -> pd.Series:
+        return pd.Series(values, index=self.columns, name=name)
+
+    def _empty(self, name: str) -> pd.Series:
+        return self._series(np.full(len(self.columns), np.nan), name)
+
+    def first(self, start_date=None, end_date=None) -> pd.Series:
+        i, j = self._bounds(start_date, end_date)
+        return self._series(self.values[i], "first") if j > i else self._empty("first")
+
+    def last(self, start_date=None, end_date=None) -> pd.Series:
+        i, j = self._bounds(start_date, end_date)
+        return self._series(self.values[j - 1], "last") if j > i else self._empty("last")
+
+    def net_change(self, start_date=None, end_date=None) -> pd.Series:
+        i, j = self._bounds(start_date, end_date)
+        if j <= i:
+            return self._empty("net_change")
+        return self._series(self.values[j - 1] - self.values[i], "net_change")
+
+    def mean(self, start_date=None, end_date=None) -> pd.Series:
+        i, j = self._bounds(start_date, end_date)
+        counts = self._counts[j] - self._counts[i]
+        sums = self._sums[j] - self._sums[i]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self._series(np.where(counts > 0, sums / counts, np.nan), "mean")
+
+    def _extreme(self, tables: list[np.ndarray], combine, start_date, end_date, name: str) -> pd.Series:
+        i, j = self._bounds(start_date, end_date)
+        if j <= i:
+            return self._empty(name)
+        level = (j - i).bit_length() - 1
+        table = tables[level]
+        return self._series(combine(table[i], table[j - (1 << level)]), name)
+
+    def min(self, start_date=None, end_date=None) -> pd.Series:
+        return self._extreme(self._mins, np.fmin, start_date, end_date, "min")
+
+    def max(self, start_date=None, end_date=None) -> pd.Series:
+        return self._extreme(self._maxs, np.fmax, start_date, end_date, "max")
+
+    def summary(self, start_date=None, end_date=None) -> pd.DataFrame:
+        """All window statistics, one row per column of the indexed frame."""
+        return pd.concat(
+            [getattr(self, statistic)(start_date, end_date) for statistic in WINDOW_STATISTICS],
+            axis=1,
+        )
@@ -0,0 +1,36 @@
+import threading
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Bound the calls made to one provider from many threads.
+
+    Used as a context manager around each request: at most
+    ``max_concurrent`` requests are in flight at once, and when
+    ``per_second`` is given consecutive requests start at least
+    ``1 / per_second`` seconds apart.
+    """
+
+    def __init__(self, max_concurrent: int = 4, per_second: Optional[float] = None):
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._interval = 1.0 / per_second if per_second else 0.0
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def __enter__(self):
+        self._slots.acquire()
+        if self._interval:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start)
+                self._next_start = start + self._interval
+            if start > now:
+                time.sleep(start - now)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._slots.release()
+        return False
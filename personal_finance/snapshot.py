@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from personal_finance.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_DIR = Path(".cache") / "snapshots"
+
+
+def workbook_bytes(table_file) -> bytes:
+    """
+    Whole content of a workbook given as a file-like object, whatever its
+    current position, which is left where it was.
+    """
+    if hasattr(table_file, "getvalue"):
+        return table_file.getvalue()
+    position = table_file.tell()
+    table_file.seek(0)
+    try:
+        return table_file.read()
+    finally:
+        table_file.seek(position)
+
+
+def workbook_hash(table_path) -> str:
+    """Return the sha256 of a workbook given as a path or a file-like object."""
+    digest = hashlib.sha256()
+    if isinstance(table_path, (str, os.PathLike)):
+        with open(table_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    else:
+        digest.update(workbook_bytes(table_path))
+    return digest.hexdigest()
+
+
+class SnapshotStore:
+    """
+    On-disk columnar snapshots of normalized workbook sheets.
+
+    Each workbook gets a directory named after its content hash holding a
+    ``manifest.json`` with the sheet names and one Parquet file per sheet
+    that has been parsed so far. Unchanged workbooks are then read back
+    with memory-mapped Parquet reads instead of an Excel parse.
+    """
+
+    def __init__(self, root: Path = DEFAULT_SNAPSHOT_DIR):
+        self.root = Path(root)
+
+    def _manifest_path(self, digest: str) -> Path:
+        return self.root / digest / "manifest.json"
+
+    def _sheet_path(self, digest: str, sheet_names: list[str], sheet_name: str) -> Path:
+        return self.root / digest / f"{sheet_names.index(sheet_name)}.parquet"
+
+    def sheet_names(self, digest: str) -> Optional[list[str]]:
+        manifest_path = self._manifest_path(digest)
+        if not manifest_path.exists():
+            return None
+        with open(manifest_path, "r") as f:
+            return json.load(f)["sheets"]
+
+    def save_sheet_names(self, digest: str, sheet_names: list[str]):
+        def write(tmp_name):
+            with open(tmp_name, "w") as f:
+                json.dump({"sheets": list(sheet_names)}, f)
+        atomic_write(self._manifest_path(digest), write)
+
+    def load(self, digest: str, sheet_name: str) -> Optional[pd.DataFrame]:
+        sheet_names = self.sheet_names(digest)
+        if sheet_names is None or sheet_name not in sheet_names:
+            return None
+        path = self._sheet_path(digest, sheet_names, sheet_name)
+        if not path.exists():
+            return None
+        return pd.read_parquet(path, memory_map=True)
+
+    def save(self, digest: str, sheet_name: str, df: pd.DataFrame):
+        sheet_names = self.sheet_names(digest)
+        if sheet_names is None or sheet_name not in sheet_names:
+            raise KeyError(sheet_name)
+        path = self._sheet_path(digest, sheet_names, sheet_name)
+        try:
+            atomic_write(path, lambda tmp_name: df.to_parquet(tmp_name, index=False))
+        except Exception as e:
+            # A sheet that cannot be stored (e.g. mixed-type columns) is simply re-parsed next time
+            logger.warning(f"Could not snapshot sheet '{sheet_name}': {e}")
@@ -0,0 +1,84 @@
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from personal_finance.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYMBOLS_PATH = Path(".cache") / "symbols.json"
+
+# Connections kept open per host; matches the largest fetch pool
+HTTP_POOL_SIZE = 16
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def http_session() -> requests.Session:
+    """Process-wide session so provider calls reuse pooled connections (DNS, TLS) across requests."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+class SymbolCache:
+    """
+    Persistent provider lookups that do not change between runs.
+
+    Entries are grouped by provider, e.g. the EODHD ticker, exchange and
+    currency an ISIN resolves to, or the quote currency of a Yahoo ticker.
+    The whole cache is one small JSON file, rewritten atomically whenever
+    a new entry is added. Safe to use from several fetch threads.
+    """
+
+    def __init__(self, path: Path = DEFAULT_SYMBOLS_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._entries: Optional[dict[str, dict]] = None
+
+    def _load(self) -> dict[str, dict]:
+        if self._entries is None:
+            self._entries = {}
+            if self.path.exists():
+                try:
+                    with open(self.path, "r") as f:
+                        self._entries = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Ignoring unreadable symbol cache {self.path}: {e}")
+        return self._entries
+
+    def get(self, provider: str, key: str):
+        with self._lock:
+            return self._load().get(provider, {}).get(key)
+
+    def put(self, provider: str, key: str, value):
+        with self._lock:
+            entries = self._load()
+            entries.setdefault(provider, {})[key] = value
+
+            def write(tmp_name):
+                with open(tmp_name, "w") as f:
+                    json.dump(entries, f, indent=1, sort_keys=True)
+            atomic_write(self.path, write)
+
+
+_default_cache: Optional[SymbolCache] = None
+
+
+def default_symbol_cache() -> SymbolCache:
+    global _default_cache
+    with _session_lock:
+        if _default_cache is None:
+            _default_cache = SymbolCache()
+        return _default_cache
@@ -1,14 +1,47 @@
+import os
+import tempfile
 import unittest
 from pathlib import Path
+from unittest import mock
+import numpy as np
 import pandas as pd
 
-from personal_finance.data import create_accounts, create_holdings
-from personal_finance.account import AccountList
+from personal_finance.data import WorkbookSource, create_accounts, create_holdings, reload_accounts
+from personal_finance.account import Account, AccountList
+from personal_finance.holdings import wait_for_price_refreshes
+from personal_finance.output import flush_writes
+from personal_finance.snapshot import SnapshotStore
+
+DATA_PATH = Path("data/demo_data.xlsx").resolve()
+
+
+_module_patches = []
+
+
+def setUpModule():
+    # Run where the default .cache stores and holdings.csv are a fresh temporary
+    # directory, pricing holdings offline and writing no holdings output
+    tmp = tempfile.TemporaryDirectory()
+    cwd = os.getcwd()
+    os.chdir(tmp.name)
+    patcher = mock.patch.dict("os.environ", {"PRICE_PROVIDERS": "offline", "HOLDINGS_OUTPUT": "none"})
+    patcher.start()
+    _module_patches.extend([patcher.stop, lambda: os.chdir(cwd), tmp.cleanup])
+
+
+def tearDownModule():
+    # Background refreshes and state saves write into the temporary directory
+    wait_for_price_refreshes()
+    flush_writes()
+    for undo in _module_patches:
+        undo()
+    _module_patches.clear()
+
 
 class TestPersonalFinanceData(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
-        cls.data_path = Path("data/demo_data.xlsx")
+        cls.data_path = DATA_PATH
         # Ensure path exists so tests fail gracefully if missing
         if not cls.data_path.exists():
             raise FileNotFoundError(f"Test data not found at {cls.data_path}")
@@ -41,6 +74,180 @@ class TestPersonalFinanceData(unittest.TestCase):
         self.assertFalse(tx["valuation"].isnull().all())
         self.assertFalse(tx["balance"].isnull().all())
         
+    def test_workbook_source_parses_each_sheet_once(self):
+        """Test that a shared WorkbookSource never re-parses a sheet."""
+        source = WorkbookSource(self.data_path)
+        create_holdings(source)
+        create_accounts(source)
+        create_accounts(source)
+        self.assertEqual(source.parse_count, len(source.sheet_names))
+
+    def test_snapshot_store_skips_excel_parse(self):
+        """Test that a second load of an unchanged workbook reads snapshots only."""
+        with tempfile.TemporaryDirectory() as tmp:
+            snapshots = SnapshotStore(Path(tmp))
+            first = WorkbookSource(self.data_path, snapshots=snapshots)
+            expected = first.sheet("Barclays")
+
+            second = WorkbookSource(self.data_path, snapshots=snapshots)
+            loaded = second.sheet("Barclays")
+            self.assertEqual(second.parse_count, 0)
+            self.assertEqual(second.snapshot_hits, 1)
+            pd.testing.assert_frame_equal(loaded, expected)
+
+    def test_reload_unchanged_workbook_reuses_accounts(self):
+        """Test that reloading an unchanged workbook rebuilds nothing."""
+        accounts = create_accounts(self.data_path)
+        accounts.calculate_balances()
+        expected = accounts.merged_balances.copy()
+
+        reloaded, report = reload_accounts(self.data_path, accounts)
+        self.assertEqual(report.rebuilt, [])
+        self.assertEqual(sorted(report.reused), sorted(accounts.get_ids()))
+        self.assertIs(reloaded["Barclays"], accounts["Barclays"])
+
+        reloaded.calculate_balances()
+        pd.testing.assert_frame_equal(reloaded.merged_balances, expected)
+
+        # Holdings that were served stale prices are rebuilt even when unchanged
+        accounts["Holdings"].holdings.stale_prices = ["IE00B4L5Y983"]
+        reloaded, report = reload_accounts(self.data_path, accounts)
+        self.assertEqual(report.rebuilt, ["Holdings"])
+        self.assertIsNot(reloaded["Holdings"], accounts["Holdings"])
+
+    def test_parallel_create_accounts_matches_serial(self):
+        """Test that the process-pool loader returns the same accounts in the same order."""
+        serial = create_accounts(self.data_path)
+        parallel = create_accounts(self.data_path, workers=2)
+        self.assertEqual(parallel.get_ids(), serial.get_ids())
+        for account_id in serial.get_ids():
+            self.assertEqual(parallel[account_id].fingerprint, serial[account_id].fingerprint)
+            pd.testing.assert_frame_equal(parallel[account_id].transactions, serial[account_id].transactions)
+
+        # A file handle the parent has already read through is re-read from the start for the workers
+        with open(self.data_path, "rb") as f:
+            from_handle = create_accounts(f, workers=2)
+        self.assertEqual(from_handle.get_ids(), serial.get_ids())
+        self.assertEqual(from_handle["Barclays"].fingerprint, serial["Barclays"].fingerprint)
+
+    def test_validation_modes(self):
+        """Test that sample validation coerces like full validation and trusted skips it."""
+        transactions = pd.DataFrame({
+            "date": pd.date_range("2024-01-01", periods=500),
+            "balance": range(500),
+            "transaction_number": range(500),
+        })
+        make = lambda mode: Account("A", None, None, "Current", "GBP", "Active", transactions.copy(), validation=mode)
+
+        pd.testing.assert_frame_equal(make("sample").transactions, make("full").transactions)
+        self.assertEqual(make("full").transactions["balance"].dtype, float)
+        self.assertEqual(make("trusted").transactions["balance"].dtype, transactions["balance"].dtype)
+        self.assertIsNotNone(make("full").validation_seconds)
+        with self.assertRaises(ValueError):
+            make("partial")
+
+    def test_blank_closing_balance_carries_previous_day(self):
+        """Test that a day ending on a blank balance keeps the previous day's balance."""
+        transactions = pd.DataFrame({
+            "date": pd.to_datetime(["2024-01-01", "2024-01-05", "2024-01-10"]),
+            "balance": [100.0, np.nan, 50.0],
+            "transaction_number": [1, 2, 3],
+        })
+        accounts = AccountList({"A": Account("A", None, None, "Current", "GBP", "Active", transactions)})
+        accounts.calculate_balances()
+        self.assertEqual(accounts.merged_balances.loc["2024-01-04":"2024-01-07", "A"].tolist(), [100.0] * 4)
+        self.assertEqual(accounts.merged_balances.loc["2024-01-10", "A"], 50.0)
+
+    def test_calculate_balance_extends_incrementally(self):
+        """Test that growing windows and appended transactions match a fresh computation."""
+        transactions = pd.DataFrame({
+            "date": pd.to_datetime(["2024-01-01", "2024-01-05", "2024-01-05", "2024-02-01"]),
+            "balance": [10.0, 20.0, 25.0, 5.0],
+            "transaction_number": [1, 2, 3, 4],
+        })
+        make = lambda: Account("A", None, None, "Current", "GBP", "Active", transactions.copy())
+        incremental = make()
+        for end in ["2024-01-10", "2024-01-20", "2024-02-10"]:
+            incremental.calculate_balance("2024-01-01", end)
+        incremental.append_transactions(pd.DataFrame({
+            "date": pd.to_datetime(["2024-02-05"]), "balance": [7.0], "transaction_number": [5],
+        }))
+        incremental.calculate_balance("2023-12-30", "2024-02-10")
+
+        fresh = make()
+        fresh.append_transactions(incremental.transactions.iloc[[-1]])
+        fresh.calculate_balance("2023-12-30", "2024-02-10")
+        pd.testing.assert_frame_equal(incremental.balance, fresh.balance)
+
+        balance = incremental.balance.set_index("date")["A"]
+        self.assertTrue(pd.isna(balance["2023-12-31"]))
+        self.assertEqual(balance["2024-01-05"], 25.0)
+        self.assertEqual(balance["2024-02-10"], 7.0)
+
+    def test_balance_matrix_is_zero_copy_and_supports_float32(self):
+        """Test that merged_balances is a view of the balance matrix in either precision."""
+        accounts = create_accounts(self.data_path)
+        accounts.calculate_balances()
+        expected = accounts.merged_balances.copy()
+        self.assertTrue(np.shares_memory(accounts.merged_balances.to_numpy(), accounts.balance_matrix.values))
+
+        compact = AccountList(dict(accounts), balance_dtype=np.float32)
+        compact.calculate_balances()
+        self.assertEqual(compact.merged_balances.dtypes.unique().tolist(), [np.float32])
+        np.testing.assert_allclose(compact.merged_balances.to_numpy(), expected.to_numpy(), rtol=1e-5)
+
+    def test_calculate_balances_populates_account_balances(self):
+        """Test that every account's balance matches calculate_balance over the merged range."""
+        accounts = create_accounts(self.data_path)
+        accounts.calculate_balances()
+        start, end = accounts.merged_balances.index[[0, -1]]
+        for account_id in ("AMEX", "Holdings"):
+            single = Account("X", None, None, "Current", "GBP", "Active",
+                             accounts[account_id].transactions.copy(), validation="trusted")
+            single.calculate_balance(start, end)
+            pd.testing.assert_frame_equal(
+                accounts[account_id].balance, single.balance.rename(columns={"X": account_id}), check_freq=False
+            )
+
+    def test_balances_as_of_matches_daily_grid(self):
+        """Test that change-point lookups agree with merged_balances."""
+        accounts = create_accounts(self.data_path)
+        accounts.calculate_balances()
+        merged = accounts.merged_balances
+        month_ends = merged.resample("ME").last().index[:-1]
+
+        snapshot = accounts.balances_as_of(month_ends)
+        pd.testing.assert_frame_equal(snapshot, merged.loc[month_ends], check_freq=False)
+        self.assertEqual(accounts.balance_as_of(month_ends[3])["total"], merged.loc[month_ends[3], "total"])
+        self.assertEqual(accounts["AMEX"].balance_as_of(month_ends[3]), merged.loc[month_ends[3], "AMEX"])
+
+    def test_rollups_match_resampling(self):
+        """Test that windowed rollups equal resampling the sliced daily balances."""
+        accounts = create_accounts(self.data_path)
+        accounts.calculate_balances()
+        merged = accounts.merged_balances
+        for freq in ("W", "ME", "YE"):
+            for start, end in [(None, None), ("2021-03-15", "2024-07-09"), ("2019-01-01", "2030-01-01")]:
+                pd.testing.assert_frame_equal(
+                    accounts.rollup(freq, start, end),
+                    merged.loc[start:end].resample(freq).last(),
+                    check_freq=False,
+                )
+
+    def test_balance_index_window_statistics(self):
+        """Test that range-query statistics match aggregating the sliced frame."""
+        accounts = create_accounts(self.data_path)
+        accounts.calculate_balances()
+        merged = accounts.merged_balances
+        start, end = merged.index[40], merged.index[1000]
+        window = merged.loc[start:end]
+
+        summary = accounts.balance_index().summary(start, end)
+        pd.testing.assert_series_equal(summary["mean"], window.mean(), check_names=False)
+        pd.testing.assert_series_equal(summary["min"], window.min(), check_names=False)
+        pd.testing.assert_series_equal(summary["max"], window.max(), check_names=False)
+        pd.testing.assert_series_equal(summary["net_change"], window.iloc[-1] - window.iloc[0], check_names=False)
+
     def test_calculate_balances(self):
         """Test the merging process across all accounts."""
         accounts = create_accounts(self.data_path)
@@ -0,0 +1,802 @@
+import os
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from collections import deque
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from personal_finance import providers
+from personal_finance.holdings import _average_cost_invested, _invested_matrix, _required_intervals, calculate_pnl, get_historical_holdings, holdings_cube, wait_for_price_refreshes
+from personal_finance.intervals import intervals_from_dates, merge_intervals, subtract_intervals
+from personal_finance.calendars import exchange_for, trading_calendar
+from personal_finance.fx import FxRates
+from personal_finance.holdings_state import HoldingsStateStore
+from personal_finance.holdings_cube import HoldingsCube
+from personal_finance.output import CsvSink, ParquetSink, flush_writes, output_sink
+from personal_finance.price_store import FreshnessPolicy, PriceStore, shared_price_store
+from personal_finance.providers import EodhdProvider, OfflineProvider, YahooProvider, chain_cache_dir, provider_chain
+from personal_finance.rate_limit import RateLimiter
+from personal_finance.symbols import SymbolCache
+
+
+# Keeps holdings.csv out of the working directory; sinks are tested explicitly
+_no_output = mock.patch.dict("os.environ", {"HOLDINGS_OUTPUT": "none"})
+
+
+def setUpModule():
+    _no_output.start()
+
+
+def tearDownModule():
+    _no_output.stop()
+
+
+def _reference_invested(group: pd.DataFrame) -> pd.Series:
+    """Average-cost calculation over a DataFrame, row by row, that the list-based engine must reproduce."""
+    avg_cost = 0.0
+    current_shares = 0.0
+    records = []
+    for _, row in group.sort_values("date", kind="stable").iterrows():
+        if row["shares"] > 0:
+            total_cost = (current_shares * avg_cost) + (row["shares"] * row["price"])
+            current_shares += row["shares"]
+            avg_cost = total_cost / current_shares if current_shares > 0 else 0
+        else:
+            current_shares += row["shares"]
+            if current_shares <= 1e-6:
+                current_shares = 0
+                avg_cost = 0
+        records.append({"date": row["date"], "invested": current_shares * avg_cost})
+    return pd.DataFrame(records).groupby("date")["invested"].last()
+
+
+def _reference_fifo(group: pd.DataFrame) -> pd.DataFrame:
+    """Lot-queue FIFO with a deque: invested and cumulative realized P&L per date."""
+    lots = deque()
+    realized = 0.0
+    records = []
+    for _, row in group.sort_values("date", kind="stable").iterrows():
+        if row["shares"] > 0:
+            lots.append([row["shares"], row["price"]])
+        else:
+            to_sell = -row["shares"]
+            while to_sell > 0 and lots:
+                used = min(to_sell, lots[0][0])
+                realized += used * (row["price"] - lots[0][1])
+                lots[0][0] -= used
+                to_sell -= used
+                if lots[0][0] <= 0:
+                    lots.popleft()
+        held = sum(lot[0] for lot in lots)
+        invested = sum(lot[0] * lot[1] for lot in lots) if held > 1e-6 else 0.0
+        records.append({"date": row["date"], "invested": invested, "realized": realized})
+    return pd.DataFrame(records).groupby("date").last()
+
+
+def _random_transactions(seed: int = 0, n_isins: int = 8) -> pd.DataFrame:
+    """Buys, partial sells, full sells and oversells, with some same-day trades."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for k in range(n_isins):
+        held = 0.0
+        for date in pd.date_range("2020-01-01", periods=200, freq="3D"):
+            if rng.random() < 0.2:
+                continue
+            r = rng.random()
+            if r < 0.6:
+                shares = rng.uniform(0.1, 20)
+            elif r < 0.8:
+                shares = -rng.uniform(0, held) if held > 0 else -1.0
+            elif r < 0.9:
+                shares = -held
+            else:
+                shares = -held - rng.uniform(0, 3)
+            held = held + shares if shares > 0 else max(held + shares, 0)
+            rows.append({"isin": f"ISIN{k:02d}", "date": date, "shares": shares, "price": rng.uniform(1, 100)})
+            if rng.random() < 0.1:
+                rows.append({"isin": f"ISIN{k:02d}", "date": date, "shares": rng.uniform(-5, 5), "price": rng.uniform(1, 100)})
+
+    # A core position churned hundreds of times, and one closed after every buy
+    churn_dates = pd.date_range("2020-01-02", periods=400, freq="D")
+    rows.append({"isin": "CHURN", "date": pd.Timestamp("2020-01-01"), "shares": 10.0, "price": 10.0})
+    for date in churn_dates:
+        rows.append({"isin": "CHURN", "date": date, "shares": 90.0, "price": 10.0})
+        rows.append({"isin": "CHURN", "date": date, "shares": -90.0, "price": rng.uniform(1, 100)})
+    for date in churn_dates:
+        rows.append({"isin": "ROUNDTRIP", "date": date, "shares": 5.0, "price": rng.uniform(1, 100)})
+        rows.append({"isin": "ROUNDTRIP", "date": date, "shares": -5.0, "price": rng.uniform(1, 100)})
+    return pd.DataFrame(rows)
+
+
+class TestHoldingsEngines(unittest.TestCase):
+    def test_invested_matrix_matches_reference(self):
+        """Test the one-pass average-cost engine against the DataFrame row-by-row calculation."""
+        table = _random_transactions()
+        date_range = pd.date_range(table["date"].min(), "2022-01-01")
+
+        expected = (
+            pd.concat([_reference_invested(group).rename(isin) for isin, group in table.groupby("isin")], axis=1)
+            .reindex(date_range)
+            .ffill()
+            .fillna(0)
+        )
+        pd.testing.assert_frame_equal(
+            _invested_matrix(table, date_range), expected, check_freq=False, rtol=1e-9, atol=1e-9
+        )
+        # Churning never moves the average cost of the core position
+        churn = table[table["isin"] == "CHURN"]
+        held, invested = _average_cost_invested(
+            np.zeros(len(churn), dtype=int), churn["shares"].to_numpy(), churn["price"].to_numpy()
+        )
+        self.assertTrue(np.isfinite(invested).all())
+        self.assertEqual(held[-1], 10.0)
+        self.assertAlmostEqual(invested[-1], 100.0)
+
+    def test_fifo_pnl_matches_lot_queue(self):
+        """Test the array-backed FIFO engine against a deque of lots."""
+        table = _random_transactions(seed=1)
+        prices = pd.DataFrame(
+            1.0, index=pd.date_range(table["date"].min(), "2022-01-01"), columns=sorted(table["isin"].unique())
+        )
+        pnl = calculate_pnl(table, prices, method="fifo")
+
+        for isin, group in table.groupby("isin"):
+            expected = _reference_fifo(group).reindex(prices.index).ffill().fillna(0)
+            np.testing.assert_allclose(pnl.invested[isin], expected["invested"], rtol=1e-9, atol=1e-6)
+            np.testing.assert_allclose(pnl.realized[isin], expected["realized"], rtol=1e-9, atol=1e-6)
+        pd.testing.assert_frame_equal(pnl.unrealized, pnl.shares - pnl.invested)
+
+    def test_average_pnl_is_consistent_with_invested_matrix(self):
+        """Test that average-cost P&L reuses the invested matrix and realizes gains on sells."""
+        table = pd.DataFrame({
+            "isin": ["A", "A", "A", "A"],
+            "date": pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"]),
+            "shares": [10.0, 10.0, -5.0, -15.0],
+            "price": [1.0, 2.0, 3.0, 1.0],
+        })
+        prices = pd.DataFrame({"A": [1.0, 2.0, 3.0, 1.0]}, index=table["date"])
+        pnl = calculate_pnl(table, prices, method="average")
+
+        pd.testing.assert_frame_equal(pnl.invested, _invested_matrix(table, prices.index))
+        # Average cost 1.5: selling 5 at 3 realizes 7.5, selling 15 at 1 realizes -7.5
+        self.assertEqual(pnl.realized["A"].tolist(), [0.0, 0.0, 7.5, 0.0])
+        self.assertEqual(pnl.unrealized["A"].tolist(), [0.0, 10.0, 22.5, 0.0])
+
+    def test_pnl_engine_handles_large_histories(self):
+        """Test that 100k transactions across 50 ISINs are processed well under a second."""
+        rng = np.random.default_rng(0)
+        n_rows = 100_000
+        table = pd.DataFrame({
+            "isin": rng.integers(0, 50, n_rows).astype(str),
+            "date": pd.Timestamp("2010-01-01") + pd.to_timedelta(rng.integers(0, 5000, n_rows), unit="D"),
+            "shares": rng.uniform(-1, 3, n_rows),
+            "price": rng.uniform(1, 100, n_rows),
+        })
+        prices = pd.DataFrame(
+            50.0, index=pd.date_range("2010-01-01", "2024-01-01"), columns=sorted(table["isin"].unique())
+        )
+        start = time.perf_counter()
+        for method in ("fifo", "average"):
+            calculate_pnl(table, prices, method=method)
+        self.assertLess((time.perf_counter() - start) / 2, 1.0)
+
+        # One ISIN closed after every buy
+        closing = pd.DataFrame({
+            "isin": "A",
+            "date": pd.Timestamp("2010-01-01") + pd.to_timedelta(np.arange(20_000) // 2, unit="D"),
+            "shares": np.tile([4.0, -4.0], 10_000),
+            "price": rng.uniform(1, 100, 20_000),
+        })
+        start = time.perf_counter()
+        pnl = calculate_pnl(closing, prices.iloc[:, :1].set_axis(["A"], axis=1), method="average")
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(pnl.invested["A"].abs().max(), 0.0)
+
+    def test_required_intervals_cover_held_and_transaction_days(self):
+        """Test required intervals against the day-by-day held-days calculation."""
+        table = _random_transactions(seed=2)
+        end_date = pd.Timestamp("2021-06-30")
+        for isin, group in table.groupby("isin"):
+            daily_shares = group.groupby("date")["shares"].sum()
+            cum_shares = daily_shares.reindex(pd.date_range(daily_shares.index.min(), end_date), fill_value=0).cumsum()
+            required = cum_shares[cum_shares > 1e-6].index.union(daily_shares[daily_shares != 0].index)
+            expected = intervals_from_dates(required[required <= end_date])
+            self.assertEqual(_required_intervals(group, end_date), expected, isin)
+
+
+class TestPriceStore(unittest.TestCase):
+    def test_interval_arithmetic(self):
+        """Test merging (with a gap tolerance) and subtraction of day intervals."""
+        d = pd.Timestamp
+        intervals = merge_intervals([(d("2024-01-05"), d("2024-01-10")), (d("2024-01-01"), d("2024-01-03")),
+                                     (d("2024-01-04"), d("2024-01-04")), (d("2024-01-20"), d("2024-01-25"))])
+        self.assertEqual(intervals, [(d("2024-01-01"), d("2024-01-10")), (d("2024-01-20"), d("2024-01-25"))])
+        self.assertEqual(len(merge_intervals(intervals, max_gap_days=10)), 1)
+
+        gaps = subtract_intervals(intervals, [(d("2023-12-01"), d("2024-01-02")), (d("2024-01-05"), d("2024-01-06")),
+                                              (d("2024-01-09"), d("2024-01-21"))])
+        self.assertEqual(gaps, [(d("2024-01-03"), d("2024-01-04")), (d("2024-01-07"), d("2024-01-08")),
+                                (d("2024-01-22"), d("2024-01-25"))])
+        self.assertEqual(subtract_intervals(intervals, intervals), [])
+
+
+    def test_append_read_and_compact(self):
+        """Test range reads, last-write-wins appends and compaction of a per-ISIN store."""
+        with tempfile.TemporaryDirectory() as tmp:
+            store = PriceStore(tmp, max_segments=2)
+            dates = pd.date_range("2024-01-01", periods=10)
+            store.append("GB00A", pd.Series(np.arange(10.0), index=dates))
+            store.append("GB00A", pd.Series([np.nan, 100.0], index=dates[[2, 3]]))
+            store.append("GB00B", pd.Series([5.0], index=dates[:1]))
+
+            # A fresh store only sees what is on disk
+            reopened = PriceStore(tmp, max_segments=2)
+            window = reopened.read("GB00A", "2024-01-03", "2024-01-05")
+            self.assertTrue(np.isnan(window.iloc[0]))
+            self.assertEqual(window.iloc[1:].tolist(), [100.0, 4.0])
+            self.assertEqual(reopened.isins(), ["GB00A", "GB00B"])
+            self.assertTrue(reopened.read("GB00C").empty)
+
+            store.append("GB00A", pd.Series([7.0], index=pd.DatetimeIndex(["2024-02-01"])))
+            self.assertEqual(len(store._segments("GB00A")), 0)
+            pd.testing.assert_series_equal(PriceStore(tmp).read("GB00A"), store.read("GB00A"))
+            self.assertEqual(len(store.read("GB00A")), 11)
+
+    def test_coverage_is_persisted(self):
+        """Test that requested and known-missing intervals survive a reopen and shrink the gaps."""
+        with tempfile.TemporaryDirectory() as tmp:
+            d = pd.Timestamp
+            store = PriceStore(tmp)
+            store.record_coverage("GB00A", [(d("2024-01-01"), d("2024-01-31"))],
+                                  missing=[(d("2024-01-10"), d("2024-01-12"))])
+            store.record_coverage("GB00A", [(d("2024-02-01"), d("2024-02-10"))])
+
+            reopened = PriceStore(tmp)
+            self.assertEqual(reopened.coverage("GB00A"), [(d("2024-01-01"), d("2024-02-10"))])
+            self.assertEqual(reopened.missing("GB00A"), [(d("2024-01-10"), d("2024-01-12"))])
+            self.assertEqual(reopened.gaps("GB00A", [(d("2023-12-30"), d("2024-02-12"))]),
+                             [(d("2023-12-30"), d("2023-12-31")), (d("2024-02-11"), d("2024-02-12"))])
+
+    def test_freshness_policy_expires_recent_days_and_missing_intervals(self):
+        """Test that recent days are refetched after the TTL, settled ones never, and misses back off."""
+        with tempfile.TemporaryDirectory() as tmp:
+            d = pd.Timestamp
+            store = PriceStore(tmp, freshness=FreshnessPolicy(settle_days=3, recent_ttl=pd.Timedelta(hours=1)))
+            fetched_at = d("2024-03-15 12:00")
+            required = [(d("2024-03-01"), d("2024-03-15"))]
+            store.record_coverage("GB00A", required, missing=[(d("2024-03-04"), d("2024-03-05"))], now=fetched_at)
+
+            self.assertEqual(store.gaps("GB00A", required, now=fetched_at + pd.Timedelta(minutes=30)), [])
+            # Only the days that had not settled at fetch time go stale
+            self.assertEqual(PriceStore(tmp).gaps("GB00A", required, now=fetched_at + pd.Timedelta(hours=2)),
+                             [(d("2024-03-12"), d("2024-03-15"))])
+            # The miss is retried after a day, then after two more once it fails again
+            self.assertEqual(store.gaps("GB00A", required, now=fetched_at + pd.Timedelta(days=1)),
+                             [(d("2024-03-04"), d("2024-03-05")), (d("2024-03-12"), d("2024-03-15"))])
+            retried_at = fetched_at + pd.Timedelta(days=1)
+            store.record_coverage("GB00A", [(d("2024-03-04"), d("2024-03-05"))],
+                                  missing=[(d("2024-03-04"), d("2024-03-05"))], now=retried_at)
+            reopened = PriceStore(tmp)
+            self.assertEqual(reopened.missing("GB00A"), [(d("2024-03-04"), d("2024-03-05"))])
+            self.assertNotIn((d("2024-03-04"), d("2024-03-05")),
+                             reopened.gaps("GB00A", required, now=retried_at + pd.Timedelta(days=1)))
+            self.assertIn((d("2024-03-04"), d("2024-03-05")),
+                          reopened.gaps("GB00A", required, now=retried_at + pd.Timedelta(days=2)))
+
+            # Refetching the recent days once they have settled makes them permanent
+            store.record_coverage("GB00A", [(d("2024-03-12"), d("2024-03-15"))], now=d("2024-03-20"))
+            self.assertEqual(store.gaps("GB00A", [(d("2024-03-06"), d("2024-03-15"))], now=d("2025-01-01")), [])
+
+
+def _holdings_table(n_isins: int = 12) -> pd.DataFrame:
+    rows = []
+    for k in range(n_isins):
+        for date, shares in [("2024-01-02", 10.0), ("2024-02-01", -10.0), ("2024-03-01", 5.0)]:
+            rows.append({"isin": f"GB{k:04d}", "full_name": f"Fund {k}", "yf_name": f"F{k}.L",
+                         "date": pd.Timestamp(date), "shares": shares, "price": 10.0 + k})
+    return pd.DataFrame(rows)
+
+
+def _fake_closes(yf_name, start_date, end_date) -> pd.Series:
+    dates = pd.bdate_range(start_date, end_date)
+    return pd.Series(float(yf_name[1:-2]) + dates.dayofyear / 100, index=dates)
+
+
+def _unlimited_providers(yf_batch: bool = True) -> list:
+    """Default provider chain without the per-second limits, to keep tests fast."""
+    return [
+        YahooProvider(RateLimiter(max_concurrent=4), batch=yf_batch),
+        EodhdProvider(RateLimiter(max_concurrent=4)),
+    ]
+
+
+class TestConcurrentFetching(unittest.TestCase):
+    def test_rate_limiter_bounds_concurrency_and_spacing(self):
+        """Test that the limiter caps requests in flight and spaces their starts."""
+        limiter = RateLimiter(max_concurrent=2, per_second=50)
+        in_flight, peak, starts = [0], [0], []
+        lock = threading.Lock()
+
+        def call():
+            with limiter:
+                with lock:
+                    in_flight[0] += 1
+                    peak[0] = max(peak[0], in_flight[0])
+                    starts.append(time.monotonic())
+                time.sleep(0.02)
+                with lock:
+                    in_flight[0] -= 1
+
+        threads = [threading.Thread(target=call) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+        # Ten starts at 50 per second span at least nine intervals of 20ms
+        self.assertGreaterEqual(max(starts) - min(starts), 0.17)
+
+    def test_concurrent_fetch_matches_serial_fetch(self):
+        """Test that fetching blocks in parallel gives the same holdings and cache as a serial run."""
+        in_flight, peak = [0], [0]
+        lock = threading.Lock()
+
+        def fake_yf(yf_name, start_date, end_date):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return _fake_closes(yf_name, start_date, end_date), "GBP"
+
+        table = _holdings_table()
+        results = {}
+        with mock.patch.object(providers, "_fetch_from_yf", side_effect=fake_yf), \
+                mock.patch.object(providers, "_fetch_from_eodhd", return_value=(pd.Series(dtype=float), None)):
+            for max_workers in (1, 8):
+                with tempfile.TemporaryDirectory() as tmp:
+                    store = PriceStore(tmp)
+                    results[max_workers] = get_historical_holdings(
+                        table, end_date=pd.Timestamp("2024-04-30"), price_store=store,
+                        max_workers=max_workers, providers=_unlimited_providers(yf_batch=False),
+                    )
+                    reopened = PriceStore(tmp)
+                    results[max_workers, "cache"] = {isin: reopened.read(isin) for isin in reopened.isins()}
+                    results[max_workers, "coverage"] = {isin: reopened.coverage(isin) for isin in reopened.isins()}
+
+        self.assertGreater(peak[0], 1)
+        self.assertLessEqual(peak[0], 4)
+        pd.testing.assert_frame_equal(results[1], results[8])
+        self.assertEqual(results[1, "coverage"], results[8, "coverage"])
+        for isin, prices in results[1, "cache"].items():
+            pd.testing.assert_series_equal(prices, results[8, "cache"][isin])
+
+    def test_batched_yahoo_downloads(self):
+        """Test that cold-cache Yahoo blocks are fetched with one multi-ticker download."""
+        def fake_download(yf_names, start_date, end_date):
+            return {yf_name: _fake_closes(yf_name, start_date, end_date) for yf_name in yf_names}
+
+        table = _holdings_table()
+        results = {}
+        with mock.patch.object(providers, "_download_yf", side_effect=fake_download) as download, \
+                mock.patch.object(providers, "_yf_currency", side_effect=lambda name: "GBp" if name == "F3.L" else "GBP"), \
+                mock.patch.object(providers, "_fetch_from_yf", side_effect=lambda *args: (
+                    _fake_closes(*args), "GBp" if args[0] == "F3.L" else "GBP")), \
+                mock.patch.object(providers, "_fetch_from_eodhd", return_value=(pd.Series(dtype=float), None)) as eodhd:
+            for yf_batch in (False, True):
+                with tempfile.TemporaryDirectory() as tmp:
+                    results[yf_batch] = get_historical_holdings(
+                        table, end_date=pd.Timestamp("2024-04-30"), price_store=PriceStore(tmp),
+                        providers=_unlimited_providers(yf_batch),
+                    )
+
+        self.assertEqual(download.call_count, 1)
+        self.assertEqual(sorted(download.call_args.args[0]), sorted(table["yf_name"].unique()))
+        eodhd.assert_not_called()
+        pd.testing.assert_frame_equal(results[False], results[True])
+
+    def test_fx_rates_are_fetched_once_per_pair(self):
+        """Test that every USD series is converted from one cached USDGBP=X download."""
+        def fake_download(yf_names, start_date, end_date):
+            return {yf_name: _fake_closes(yf_name, start_date, end_date) for yf_name in yf_names}
+
+        def fake_fx(pair, start_date, end_date):
+            dates = pd.bdate_range(start_date, end_date)
+            return pd.Series(0.5 if pair == "USDGBP=X" else 0.8, index=dates)
+
+        table = _holdings_table(n_isins=6)
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(providers, "_download_yf", side_effect=fake_download), \
+                mock.patch.object(providers, "_yf_currency", side_effect=lambda name: "USD" if name < "F3" else "EUR"), \
+                mock.patch.object(providers, "_fetch_from_eodhd", return_value=(pd.Series(dtype=float), None)), \
+                mock.patch.object(providers, "_download_fx", side_effect=fake_fx) as download_fx:
+            fx_store = PriceStore(f"{tmp}/fx")
+            result = get_historical_holdings(
+                table, end_date=pd.Timestamp("2024-04-30"), price_store=PriceStore(f"{tmp}/prices"),
+                providers=_unlimited_providers(), fx_rates=FxRates(fx_store),
+            )
+            self.assertEqual(sorted(call.args[0] for call in download_fx.call_args_list), ["EURGBP=X", "USDGBP=X"])
+
+            # Another run needing rates inside the fetched range reuses the cached rates
+            rates = FxRates(fx_store)
+            rates.require("USD", "2024-03-04", "2024-04-01")
+            rates.fetch(_unlimited_providers())
+            self.assertEqual(download_fx.call_count, 2)
+
+        # Fund 0 (USD) holds 5 shares on 2024-04-30 at 0 + dayofyear / 100, converted at 0.5
+        self.assertAlmostEqual(result["Fund 0_valuation"].iloc[-1], 5 * (121 / 100) * 0.5)
+        self.assertAlmostEqual(result["Fund 4_valuation"].iloc[-1], 5 * (4 + 121 / 100) * 0.8)
+
+
+class TestSymbolResolution(unittest.TestCase):
+    def test_eodhd_search_is_cached_across_runs(self):
+        """Test that a warm symbol cache leaves only the EOD data call per block."""
+        def response(payload):
+            return mock.Mock(json=mock.Mock(return_value=payload), raise_for_status=mock.Mock())
+
+        def get(url, timeout=None):
+            if "/search/" in url:
+                isin = url.split("/search/")[1].split("?")[0]
+                return response([{"Code": "VUSA", "Exchange": "LSE", "Currency": "GBX"}] if isin == "IE00A" else [])
+            return response([{"date": "2024-01-02", "close": 100.0, "adjusted_close": 99.0}])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            session = mock.Mock(get=mock.Mock(side_effect=get))
+            with mock.patch.object(providers, "http_session", return_value=session), \
+                    mock.patch.object(providers, "_eodhd_api_key", return_value="key"):
+                for symbols in (SymbolCache(f"{tmp}/symbols.json"), SymbolCache(f"{tmp}/symbols.json")):
+                    for isin in ("IE00A", "XX00B"):
+                        series, currency = providers._fetch_from_eodhd(
+                            isin, pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-05"), symbols
+                        )
+
+            urls = [call.args[0] for call in session.get.call_args_list]
+            self.assertEqual(sum("/search/" in url for url in urls), 2)
+            self.assertEqual(sum("/eod/VUSA.LSE" in url for url in urls), 2)
+            self.assertTrue(all(call.kwargs["timeout"] == providers.REQUEST_TIMEOUT for call in session.get.call_args_list))
+            self.assertEqual(SymbolCache(f"{tmp}/symbols.json").get("eodhd", "IE00A"),
+                             {"ticker": "VUSA", "exchange": "LSE", "currency": "GBX"})
+            unmatched = SymbolCache(f"{tmp}/symbols.json").get("eodhd", "XX00B")
+            self.assertEqual(unmatched["attempts"], 1)
+
+            # The unmatched ISIN is searched again once the retry delay has passed, then backs off
+            symbols = SymbolCache(f"{tmp}/symbols.json")
+            searched = pd.Timestamp(unmatched["searched"])
+            session.get.reset_mock()
+            with mock.patch.object(providers, "http_session", return_value=session):
+                for delay in ("12h", "1D", "36h", "3D"):
+                    self.assertIsNone(providers._resolve_eodhd("XX00B", "key", symbols, now=searched + pd.Timedelta(delay)))
+            self.assertEqual(session.get.call_count, 2)
+            self.assertEqual(symbols.get("eodhd", "XX00B"),
+                             {"searched": (searched + pd.Timedelta("3D")).isoformat(), "attempts": 3})
+
+
+class TestPriceProviders(unittest.TestCase):
+    def test_provider_chain_from_names_and_environment(self):
+        """Test resolving provider names, the environment default and custom registrations."""
+        self.assertEqual([provider.name for provider in provider_chain()], ["yahoo", "eodhd"])
+        with mock.patch.dict("os.environ", {"PRICE_PROVIDERS": "offline, yahoo"}):
+            self.assertEqual([provider.name for provider in provider_chain()], ["offline", "yahoo"])
+
+        custom = OfflineProvider(synthesize=False)
+        with mock.patch.dict(providers.PROVIDERS):
+            providers.register_provider("local", lambda: custom)
+            self.assertIs(provider_chain(["local"])[0], custom)
+        with self.assertRaises(ValueError):
+            provider_chain(["nope"])
+
+    def test_offline_provider_runs_many_isins_without_network(self):
+        """Test that the offline provider serves deterministic prices and FX from files or synthesis."""
+        table = _holdings_table(n_isins=60)
+        isins = table["isin"].unique()
+        currencies = {isin: "USD" for isin in isins[::3]}
+        results = []
+        with tempfile.TemporaryDirectory() as tmp:
+            OfflineProvider(f"{tmp}/offline", currencies=currencies).write_files(
+                isins[:20], "2024-12-31", fx_currencies=["USD"]
+            )
+            with mock.patch.object(providers, "_download_yf", side_effect=AssertionError("network")):
+                for run, root in enumerate([f"{tmp}/offline", f"{tmp}/none"]):
+                    results.append(get_historical_holdings(
+                        table, end_date=pd.Timestamp("2024-04-30"), price_store=PriceStore(f"{tmp}/prices{run}"),
+                        providers=[OfflineProvider(root, currencies=currencies)],
+                        fx_rates=FxRates(PriceStore(f"{tmp}/fx{run}")),
+                    ))
+
+            on_disk = OfflineProvider(f"{tmp}/offline", synthesize=False)
+            request = providers.PriceRequest(isins[0], None, pd.Timestamp("2024-01-01"), pd.Timestamp("2024-06-30"))
+            self.assertEqual(on_disk.fetch_prices([request], None)[0][1], "USD")
+            missing = providers.PriceRequest(isins[-1], None, request.start, request.end)
+            self.assertTrue(on_disk.fetch_prices([missing], None)[0][0].empty)
+            self.assertTrue(on_disk.fetch_fx("EUR", "2024-01-01", "2024-02-01").empty)
+
+        # Prices read back from the exported files match the synthetic series exactly
+        pd.testing.assert_frame_equal(results[0], results[1])
+        self.assertFalse(results[0].filter(like="_valuation").isna().any().any())
+
+    def test_offline_runs_keep_out_of_the_default_caches(self):
+        """Test that an offline run fills its own price, FX and holdings caches and leaves the default ones untouched."""
+        table = _holdings_table(n_isins=3)
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with mock.patch.dict("os.environ", {"PRICE_PROVIDERS": "offline"}):
+                    holdings_cube(table, end_date=pd.Timestamp("2024-04-30"), incremental=True)
+                flush_writes(timeout=10)
+                cache = Path(".cache")
+                self.assertEqual(sorted(path.name for path in cache.iterdir()), ["providers"])
+                self.assertEqual(sorted(path.name for path in (cache / "providers" / "offline").iterdir()),
+                                 ["holdings", "prices"])
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(chain_cache_dir(provider_chain(["yahoo", "eodhd"])), Path(".cache"))
+        self.assertEqual(chain_cache_dir(provider_chain(["offline", "yahoo"])), Path(".cache/providers/offline+yahoo"))
+
+    def test_deadline_serves_cached_prices_and_refreshes_in_background(self):
+        """Test that a slow provider past the deadline gets cached prices now and fresh ones on the next call."""
+        release = threading.Event()
+
+        class SlowProvider(OfflineProvider):
+            def fetch_prices(self, requests, executor):
+                release.wait(5)
+                return super().fetch_prices(requests, executor)
+
+        table = _holdings_table(n_isins=3)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = PriceStore(f"{tmp}/prices")
+            kwargs = dict(end_date=pd.Timestamp("2024-04-30"), price_store=store,
+                          providers=[SlowProvider(f"{tmp}/offline")], fx_rates=FxRates(PriceStore(f"{tmp}/fx")))
+            started = time.monotonic()
+            stale = get_historical_holdings(table, deadline=0.2, **kwargs)
+            self.assertLess(time.monotonic() - started, 2)
+            self.assertEqual(stale.attrs["stale_prices"], ["GB0000", "GB0001", "GB0002"])
+            # Without any cached price the holdings are valued at cost
+            self.assertAlmostEqual(stale["Fund 1_valuation"].iloc[-1], 5 * 11.0)
+
+            release.set()
+            wait_for_price_refreshes(timeout=10)
+            fresh = get_historical_holdings(table, deadline=0.2, **kwargs)
+        self.assertEqual(fresh.attrs["stale_prices"], [])
+        self.assertNotAlmostEqual(fresh["Fund 1_valuation"].iloc[-1], 5 * 11.0)
+
+    def test_overlapping_refreshes_share_the_store(self):
+        """Test that a run queued behind an overrunning refresh of the same store fetches nothing again."""
+        release = threading.Event()
+
+        class SlowProvider(_RecordingProvider):
+            def fetch_prices(self, requests, executor):
+                release.wait(5)
+                return super().fetch_prices(requests, executor)
+
+        table = _holdings_table(n_isins=3)
+        with tempfile.TemporaryDirectory() as tmp:
+            provider = SlowProvider(f"{tmp}/offline")
+            self.assertIs(shared_price_store(f"{tmp}/prices"), shared_price_store(Path(tmp) / "prices"))
+            for _ in range(2):
+                # A fresh lookup per run, as with default_price_store()
+                get_historical_holdings(
+                    table, end_date=pd.Timestamp("2024-04-30"), price_store=shared_price_store(f"{tmp}/prices"),
+                    providers=[provider], fx_rates=FxRates(PriceStore(f"{tmp}/fx")), deadline=0.1,
+                )
+            release.set()
+            wait_for_price_refreshes(timeout=10)
+
+            self.assertEqual(len(provider.requests), len({request for request in provider.requests}))
+            for isin in table["isin"].unique():
+                self.assertEqual(len(list((Path(tmp) / "prices" / isin).glob("segment-*.parquet"))), 1)
+
+    def test_calls_behind_a_hung_refresh_do_not_wait_again(self):
+        """Test that a call while an overrunning refresh still fetches its ISINs serves cached prices at once."""
+        release = threading.Event()
+
+        class HangingProvider(_RecordingProvider):
+            def fetch_prices(self, requests, executor):
+                release.wait(10)
+                return super().fetch_prices(requests, executor)
+
+        table = _holdings_table(n_isins=3)
+        with tempfile.TemporaryDirectory() as tmp:
+            provider = HangingProvider(f"{tmp}/offline")
+            kwargs = dict(end_date=pd.Timestamp("2024-04-30"), price_store=PriceStore(f"{tmp}/prices"),
+                          providers=[provider], fx_rates=FxRates(PriceStore(f"{tmp}/fx")), deadline=1.0)
+            try:
+                first = holdings_cube(table, **kwargs)
+                started = time.monotonic()
+                second = holdings_cube(table, **kwargs)
+                self.assertLess(time.monotonic() - started, 0.5)
+            finally:
+                release.set()
+                wait_for_price_refreshes(timeout=10)
+            fresh = holdings_cube(table, **kwargs)
+
+        self.assertEqual(first.stale_prices, ["GB0000", "GB0001", "GB0002"])
+        self.assertEqual(second.stale_prices, first.stale_prices)
+        self.assertEqual(fresh.stale_prices, [])
+        # Every block was requested by the first call only
+        self.assertEqual(len({request.isin for request in provider.requests}), 3)
+        self.assertEqual(len(provider.requests), len(set(provider.requests)))
+
+    def test_infinite_deadline_waits_for_the_refresh(self):
+        """Test that PRICE_DEADLINE=inf waits for every fetch instead of failing."""
+        table = _holdings_table(n_isins=2)
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict("os.environ", {"PRICE_DEADLINE": "inf"}):
+            output = get_historical_holdings(
+                table, end_date=pd.Timestamp("2024-04-30"), price_store=PriceStore(f"{tmp}/prices"),
+                providers=[OfflineProvider(f"{tmp}/offline")], fx_rates=FxRates(PriceStore(f"{tmp}/fx")),
+            )
+        self.assertEqual(output.attrs["stale_prices"], [])
+
+class TestIncrementalHoldings(unittest.TestCase):
+    def test_incremental_runs_match_full_recomputation(self):
+        """Test that extending a saved run by new days, transactions and ISINs gives the full result."""
+        table = _holdings_table(n_isins=4)
+        # Already in the first table but dated after its end date
+        table = pd.concat([table, pd.DataFrame([{"isin": "GB0002", "full_name": "Fund 2", "yf_name": "F2.L",
+                                                 "date": pd.Timestamp("2024-05-20"), "shares": 5.0, "price": 12.0}])])
+        new_rows = pd.DataFrame([
+            {"isin": "GB0001", "full_name": "Fund 1", "yf_name": "F1.L",
+             "date": pd.Timestamp("2024-06-10"), "shares": 3.0, "price": 12.0},
+            {"isin": "GB0009", "full_name": "Fund 9", "yf_name": "F9.L",
+             "date": pd.Timestamp("2024-02-10"), "shares": 2.0, "price": 19.0},
+        ])
+        with tempfile.TemporaryDirectory() as tmp:
+            state = HoldingsStateStore(f"{tmp}/state")
+
+            def run(run_table, end_date, incremental):
+                result = get_historical_holdings(
+                    run_table, end_date=pd.Timestamp(end_date), price_store=PriceStore(f"{tmp}/prices"),
+                    providers=[OfflineProvider(f"{tmp}/offline")], fx_rates=FxRates(PriceStore(f"{tmp}/fx")),
+                    incremental=incremental, holdings_state=state,
+                )
+                flush_writes()
+                return result
+
+            run(table, "2024-04-30", incremental=True)
+            self.assertEqual(state.load("average").watermark, pd.Timestamp("2024-04-30"))
+            with mock.patch("personal_finance.holdings._invested_matrix", wraps=_invested_matrix) as engine:
+                for run_table, end_date in [(table, "2024-05-31"), (pd.concat([table, new_rows]), "2024-06-30")]:
+                    pd.testing.assert_frame_equal(run(run_table, end_date, incremental=True),
+                                                  run(run_table, end_date, incremental=False))
+            # Incremental runs only put ISINs with new or not yet applied transactions through the engine
+            engine_isins = [sorted(call.args[0]["isin"].unique()) for call in engine.call_args_list]
+            self.assertEqual(engine_isins, [
+                ["GB0002"],
+                ["GB0000", "GB0001", "GB0002", "GB0003"],
+                ["GB0001", "GB0009"],
+                ["GB0000", "GB0001", "GB0002", "GB0003", "GB0009"],
+            ])
+
+
+class TestHoldingsCube(unittest.TestCase):
+    def test_cube_views_and_flat_export(self):
+        """Test the named axes, zero-copy metric views, float32 storage and the flat export."""
+        table = _holdings_table(n_isins=5)
+        with tempfile.TemporaryDirectory() as tmp:
+            cubes = [
+                holdings_cube(
+                    table, end_date=pd.Timestamp("2024-04-30"), price_store=PriceStore(f"{tmp}/prices"),
+                    providers=[OfflineProvider(f"{tmp}/offline")], fx_rates=FxRates(PriceStore(f"{tmp}/fx")),
+                    dtype=dtype,
+                )
+                for dtype in (np.float64, np.float32)
+            ]
+            flat = get_historical_holdings(
+                table, end_date=pd.Timestamp("2024-04-30"), price_store=PriceStore(f"{tmp}/prices"),
+                providers=[OfflineProvider(f"{tmp}/offline")], fx_rates=FxRates(PriceStore(f"{tmp}/fx")),
+            )
+        cube, compact = cubes
+
+        self.assertEqual(cube.dims, ("date", "isin", "metric"))
+        self.assertEqual(cube.shape, (120, 5, 3))
+        self.assertEqual(compact.dtype, np.float32)
+        self.assertEqual(compact.values.nbytes * 2, cube.values.nbytes)
+        unrealized = cube.frame("unrealized")
+        self.assertTrue(np.shares_memory(unrealized.to_numpy(), cube.values))
+        np.testing.assert_array_equal(cube.values[:, :, 0], cube.metric("unrealized"))
+        np.testing.assert_allclose(compact.metric("valuation"), cube.metric("valuation"), rtol=1e-6)
+
+        pd.testing.assert_frame_equal(cube.to_frame(), flat)
+        self.assertEqual(list(flat.columns[1:4]), ["Fund 0", "Fund 1", "Fund 2"])
+        latest = cube.on("2024-05-20")
+        self.assertAlmostEqual(latest.loc["Fund 1", "invested"], flat["Fund 1_invested"].iloc[-1])
+        self.assertTrue(cube.on("2023-12-31").empty)
+
+        # ISINs sharing a display name keep one column each
+        shared = HoldingsCube(cube.dates, cube.isins, {isin: "Fund" for isin in cube.isins}, cube._storage)
+        flat = shared.to_frame()
+        self.assertEqual(len(flat.columns), 1 + 3 * 5 + 3)
+        self.assertEqual(list(flat.columns[1:3]), ["Fund (GB0000)", "Fund (GB0001)"])
+        np.testing.assert_array_equal(flat["Fund (GB0001)_invested"], cube.metric("invested")[:, 1])
+
+
+class TestOutputSinks(unittest.TestCase):
+    def test_holdings_are_written_in_the_background_to_the_chosen_sink(self):
+        """Test that CSV and Parquet sinks write the flat frame atomically and 'none' writes nothing."""
+        table = _holdings_table(n_isins=3)
+        with tempfile.TemporaryDirectory() as tmp:
+            kwargs = dict(end_date=pd.Timestamp("2024-04-30"), price_store=PriceStore(f"{tmp}/prices"),
+                          providers=[OfflineProvider(f"{tmp}/offline")], fx_rates=FxRates(PriceStore(f"{tmp}/fx")))
+            with mock.patch.object(CsvSink, "write", side_effect=AssertionError("written")):
+                get_historical_holdings(table, sink="none", **kwargs)
+            output = get_historical_holdings(table, sink=ParquetSink(f"{tmp}/out/holdings.parquet"), **kwargs)
+            get_historical_holdings(table, sink=CsvSink(f"{tmp}/out/holdings.csv"), **kwargs)
+            flush_writes(timeout=10)
+
+            pd.testing.assert_frame_equal(pd.read_parquet(f"{tmp}/out/holdings.parquet"), output, check_freq=False)
+            self.assertEqual(pd.read_csv(f"{tmp}/out/holdings.csv", index_col=0).shape, output.shape)
+            # Only the renamed files are left behind
+            self.assertEqual(sorted(path.name for path in Path(f"{tmp}/out").iterdir()),
+                             ["holdings.csv", "holdings.parquet"])
+            # Written files get the usual permissions, not mkstemp's private 0600
+            umask = os.umask(0)
+            os.umask(umask)
+            for name in ("holdings.csv", "holdings.parquet"):
+                self.assertEqual(stat.S_IMODE(os.stat(f"{tmp}/out/{name}").st_mode), 0o666 & ~umask)
+
+        with mock.patch.dict("os.environ", {"HOLDINGS_OUTPUT": "parquet"}):
+            self.assertIsInstance(output_sink(), ParquetSink)
+        with self.assertRaises(ValueError):
+            output_sink("xlsx")
+
+
+class _RecordingProvider(OfflineProvider):
+    """Offline provider that remembers every price request it is asked for."""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.requests = []
+
+    def fetch_prices(self, requests, executor):
+        self.requests += requests
+        return super().fetch_prices(requests, executor)
+
+
+class TestTradingCalendars(unittest.TestCase):
+    def test_exchange_holidays(self):
+        """Test the built-in London and New York holiday rules against published closures."""
+        london = trading_calendar("XLON")
+        closed = pd.bdate_range("2024-01-01", "2024-12-31")[~london.is_trading_day(pd.bdate_range("2024-01-01", "2024-12-31"))]
+        self.assertEqual([day.strftime("%m-%d") for day in closed],
+                         ["01-01", "03-29", "04-01", "05-06", "05-27", "08-26", "12-25", "12-26"])
+        self.assertFalse(london.is_trading_day(["2022-06-02", "2022-06-03", "2022-09-19", "2021-12-27", "2021-12-28"]).any())
+        self.assertTrue(london.is_trading_day(["2022-05-30"]).all())
+
+        new_york = trading_calendar("XNYS")
+        days = pd.bdate_range("2024-01-01", "2024-12-31")
+        self.assertEqual(int((~new_york.is_trading_day(days)).sum()), 10)
+        self.assertFalse(new_york.is_trading_day(["2024-11-28", "2024-06-19", "2021-12-24", "2025-01-09"]).any())
+        self.assertTrue(new_york.is_trading_day(["2021-12-31"]).all())
+
+        self.assertEqual(exchange_for("VUSA.L"), "XLON")
+        self.assertEqual(exchange_for("AAPL"), "XNYS")
+        self.assertIsNone(exchange_for("SAP.DE"))
+        self.assertEqual(len(trading_calendar(None).trading_days("2024-12-23", "2024-12-29")), 5)
+
+    def test_non_trading_gaps_are_not_requested(self):
+        """Test that refreshing over a weekend and a bank holiday makes no price requests."""
+        table = _holdings_table(n_isins=3)
+        with tempfile.TemporaryDirectory() as tmp:
+            provider = _RecordingProvider(f"{tmp}/offline")
+            store = PriceStore(f"{tmp}/prices")
+            # Thursday before Easter 2024, then Easter Monday: Good Friday to Monday are LSE closures
+            for end_date in ("2024-03-28", "2024-04-01"):
+                get_historical_holdings(table, end_date=pd.Timestamp(end_date), price_store=store, providers=[provider])
+                if end_date == "2024-03-28":
+                    self.assertEqual(len(provider.requests), 6)
+            self.assertEqual(len(provider.requests), 6)
+
+            get_historical_holdings(table, end_date=pd.Timestamp("2024-04-02"), price_store=store, providers=[provider])
+            self.assertEqual([(r.start, r.end) for r in provider.requests[6:]],
+                             [(pd.Timestamp("2024-04-02"), pd.Timestamp("2024-04-02"))] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()